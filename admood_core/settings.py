@@ -133,13 +133,29 @@ SWAGGER_SETTINGS = {
     },
 }
 
+# `shared` is one cache for every web and celery process, needed by the task locks and the versioned caches
+# to hold across processes, `local` is a per process stand-in for tests and development (`CACHE_PROFILE=local`)
+CACHE_HOST = config("CACHE_HOST", default='127.0.0.1:11211')
+CACHE_PROFILES = {
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': CACHE_HOST,
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+CACHE_PROFILE = config("CACHE_PROFILE", default='shared')
+
 CACHES = {
     'default': {
-        'BACKEND': config("CACHE_BACKEND", default='django.core.cache.backends.locmem.LocMemCache'),
-        'LOCATION': config("CACHE_HOST"),
+        **CACHE_PROFILES[CACHE_PROFILE],
         'KEY_PREFIX': 'ADMOODCORE',
     },
 }
+# an explicit backend still overrides the profile
+if config("CACHE_BACKEND", default=None):
+    CACHES['default'].update(BACKEND=config("CACHE_BACKEND"), LOCATION=CACHE_HOST)
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -319,6 +335,26 @@ ADBOT_API_TOKEN = config("ADBOT_API_TOKEN")
 ADBOT_API_URL = config('ADBOT_API_URL')
 ADBOT_AGENTS = config('ADBOT_AGENTS', default='admood')
 ADBOT_MAX_CONCURRENT_CAMPAIGN = config('ADBOT_MAX_CONCURRENT_CAMPAIGN', default=5, cast=int)
+CAMPAIGN_PROVISIONING_CONCURRENCY = config('CAMPAIGN_PROVISIONING_CONCURRENCY', default=4, cast=int)
+CAMPAIGN_CONTENT_UPLOAD_CONCURRENCY = config('CAMPAIGN_CONTENT_UPLOAD_CONCURRENCY', default=4, cast=int)
+
+DISABLE_FINISHED_CAMPAIGNS_CHUNK_SIZE = config('DISABLE_FINISHED_CAMPAIGNS_CHUNK_SIZE', default=500, cast=int)
+DASHBOARD_REPORT_FROM_ROLLUP = config('DASHBOARD_REPORT_FROM_ROLLUP', default=True, cast=bool)
+PUBLISHER_SYNC_CHUNK_SIZE = config('PUBLISHER_SYNC_CHUNK_SIZE', default=500, cast=int)
+PUBLISHER_CATALOG_TTL = config('PUBLISHER_CATALOG_TTL', default=300, cast=int)
+REPORT_INGESTION_CHUNK_SIZE = config('REPORT_INGESTION_CHUNK_SIZE', default=50, cast=int)
+REPORT_INGESTION_CONCURRENCY = config('REPORT_INGESTION_CONCURRENCY', default=8, cast=int)
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=600, cast=int)
+CACHE_COMPUTE_LOCK_TIMEOUT = config('CACHE_COMPUTE_LOCK_TIMEOUT', default=30, cast=int)
+CACHE_EARLY_REFRESH_BETA = config('CACHE_EARLY_REFRESH_BETA', default=1.0, cast=float)
+TASK_LOCK_TTL = config('TASK_LOCK_TTL', default=120, cast=int)
+SCHEDULE_TIMELINE_REFRESH = config('SCHEDULE_TIMELINE_REFRESH', default=3600, cast=int)
+
+HTTP_POOL_SIZE = config('HTTP_POOL_SIZE', default=10, cast=int)
+HTTP_CONNECT_TIMEOUT = config('HTTP_CONNECT_TIMEOUT', default=5, cast=float)
+HTTP_READ_TIMEOUT = config('HTTP_READ_TIMEOUT', default=30, cast=float)
+HTTP_MAX_RETRIES = config('HTTP_MAX_RETRIES', default=3, cast=int)
+HTTP_RETRY_BACKOFF_FACTOR = config('HTTP_RETRY_BACKOFF_FACTOR', default=0.3, cast=float)
 
 SMS_API_URL = config("SMS_API_URL")
 SMS_API_TOKEN = config("SMS_API_TOKEN")
@@ -1,7 +1,6 @@
 from django.utils.translation import ugettext_lazy as _
 from django.contrib import admin, messages
 from django.contrib.postgres.fields import JSONField
-from django.db.models import Q, Count
 from django.utils import timezone
 
 from django_json_widget.widgets import JSONEditorWidget
@@ -36,7 +35,7 @@ class IsLiveCampaignReferenceFilter(admin.SimpleListFilter):
 
     def queryset(self, request, queryset):
         if self.value() == "1":
-            return queryset.filter(**CampaignReference.objects.live_conditions)
+            return queryset.live()
         return queryset
 
 
@@ -194,15 +193,8 @@ class CampaignReferenceAdmin(admin.ModelAdmin, AutoFilter):
         return result
 
     def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        queryset = queryset.annotate(
-            # live condition
-            _is_live=Count(
-                'id',
-                filter=Q(**CampaignReference.objects.live_conditions)
-            )
-        )
-        return queryset
+        queryset = super().get_queryset(request).prefetch_related('content_stats__hourly_reports')
+        return queryset.annotate_live('_is_live')
 
     # custom fields
     def is_live(self, obj):
@@ -217,11 +209,11 @@ class CampaignReferenceAdmin(admin.ModelAdmin, AutoFilter):
         return getattr(obj.schedule_range, 'upper', '')
 
     def views(self, obj):
-        all_views = self.iterate_contents(obj.contents, 'views')
+        all_views = self.iterate_contents(obj.get_contents(), 'views')
         return str(all_views) if all_views else ""
 
     def ref_ids(self, obj):
-        all_message_id = self.iterate_contents(obj.contents, 'ref_id')
+        all_message_id = self.iterate_contents(obj.get_contents(), 'ref_id')
         return str(all_message_id).replace('\'', '') if all_message_id else ""
 
 
@@ -1,17 +1,26 @@
 import logging
 import datetime
+from collections import defaultdict
 from datetime import timedelta
+from operator import itemgetter
 
-from django.db.models.functions import Lower
+from django.conf import settings
+from django.db import models
+from django.db.models import ExpressionWrapper, F, Min, Prefetch, Sum
+from django.db.models.functions import Coalesce, ExtractHour, Lower, TruncDay
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
 from khayyam import JalaliDatetime
 from rest_framework import serializers
 
-from apps.campaign.models import Province, Campaign, CampaignContent, CampaignSchedule, TargetDevice, CampaignReference
+from apps.campaign.models import (
+    Province, Campaign, CampaignContent, CampaignSchedule, TargetDevice, CampaignReference,
+    CampaignReferenceHourlyReport, CampaignSpend
+)
 from apps.campaign.utils import get_hourly_report_dashboard, compute_telegram_cost
 from apps.core.consts import CostModel
 from apps.core.models import File
+from apps.core.utils.get_file import FileResolver, content_file_pks
 from apps.medium.consts import Medium
 from apps.medium.models import Publisher, Category
 from apps.medium.api.serializers import CategorySerializer, MinorPublisherSerializer
@@ -71,15 +80,36 @@ class CampaignSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['status']
 
+    @staticmethod
+    def prefetch(queryset):
+        """
+        Loading the relations rendered for the campaigns of `queryset` with one query per relation,
+        so the number of queries of a page does not grow with its size.
+        """
+        return queryset.prefetch_related(
+            Prefetch('categories', queryset=Category.objects.only('id', 'display_text')),
+            Prefetch('publishers', queryset=Publisher.objects.only('id', 'name')),
+            Prefetch('final_publishers', queryset=Publisher.objects.only('id', 'name')),
+            'locations',
+            Prefetch(
+                'target_devices', queryset=TargetDevice.objects.only('id', 'campaign', 'device', 'service_provider')
+            ),
+            'schedules',
+            Prefetch(
+                'campaignreference_set',
+                queryset=CampaignReference.objects.only('id', 'campaign').annotate(
+                    display_text=Lower('schedule_range')
+                ),
+                to_attr='campaign_reference_items',
+            ),
+        )
+
     def to_representation(self, instance):
         data = super(CampaignSerializer, self).to_representation(instance)
-        data['categories'] = CategorySerializer(Category.objects.filter(id__in=data['categories']),many=True).data
-
-        data['publishers'] = MinorPublisherSerializer(
-            Publisher.objects.filter(id__in=data['publishers']),
-            many=True
-        ).data
-        data['locations'] = ProvinceSerializer(Province.objects.filter(id__in=data['locations']), many=True).data
+        # read from the prefetched relations when the campaign is loaded by `prefetch`
+        data['categories'] = CategorySerializer(instance.categories.all(), many=True).data
+        data['publishers'] = MinorPublisherSerializer(instance.publishers.all(), many=True).data
+        data['locations'] = ProvinceSerializer(instance.locations.all(), many=True).data
 
         return data
 
@@ -95,6 +125,11 @@ class CampaignSerializer(serializers.ModelSerializer):
         return extra_kwargs
 
     def get_campaign_references(self, obj):
+        if hasattr(obj, 'campaign_reference_items'):
+            return [
+                {'id': reference.id, 'display_text': reference.display_text}
+                for reference in obj.campaign_reference_items
+            ]
         return obj.campaignreference_set.annotate(
             display_text=Lower('schedule_range')
         ).values('id', 'display_text')
@@ -316,6 +351,16 @@ class CampaignDuplicateSerializer(serializers.ModelSerializer):
         return instance
 
 
+class CampaignContentListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # the files of all contents of the page are fetched with one query
+        contents = list(data.all() if isinstance(data, models.Manager) else data)
+        self.child.file_resolver.prefetch(
+            file_id for content in contents for file_id in content_file_pks(content.data)
+        )
+        return super().to_representation(contents)
+
+
 class CampaignContentSerializer(serializers.ModelSerializer):
     file_url = serializers.SerializerMethodField()
     campaign_status = serializers.ReadOnlyField()
@@ -325,6 +370,11 @@ class CampaignContentSerializer(serializers.ModelSerializer):
         model = CampaignContent
         exclude = ('is_hidden',)
         read_only_fields = ('campaign',)
+        list_serializer_class = CampaignContentListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.file_resolver = FileResolver()
 
     def validate(self, attrs):
         data = attrs.get('data')
@@ -364,25 +414,23 @@ class CampaignContentSerializer(serializers.ModelSerializer):
         return attrs
 
     def get_file_url(self, obj):
+        request = self.context['request']
         try:
             files = obj.data.get('file')
             if files is not None and isinstance(files, list):
-                file_urls = []
-                for f_id in files:
-                    try:
-                        file_obj = File.objects.get(pk=f_id)
-                    except File.DoesNotExist:
-                        continue
-                    file_urls.append({
-                        "id": file_obj.id,
-                        "file": self.context['request'].build_absolute_uri(file_obj.file.url),
-                        "type": file_type(file_obj.__str__())
-                    })
-                return file_urls
+                return [
+                    {
+                        "id": self.file_resolver.get(f_id).id,
+                        "file": self.file_resolver.url(f_id, request),
+                        "type": self.file_resolver.file_type(f_id),
+                    }
+                    for f_id in files if self.file_resolver.get(f_id) is not None
+                ]
             else:
                 file_id = files or obj.data.get('imageId')
-                file = File.objects.get(pk=file_id).file
-                return self.context['request'].build_absolute_uri(file.url)
+                if self.file_resolver.get(file_id) is None:
+                    raise File.DoesNotExist(f'file {file_id} does not exist')
+                return self.file_resolver.url(file_id, request)
         except Exception as e:
             logger.error(f'[getting file url for campaign content failed]-[campaing content id: {obj.id}]-[exc: {e}]')
             return None
@@ -400,12 +448,13 @@ class CampaignReferenceSerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'date', 'display_text', 'contents_detail', 'publishers_detail')
 
     def contents_detail_handler(self, obj):
+        contents = obj.get_contents()
         campaign_contents = CampaignContent.objects.filter(
-            id__in=[item['content'] for item in obj.contents],
+            id__in=[item['content'] for item in contents],
             cost_model_price__gt=0
         ).values('id', 'title')
         result = []
-        for content in obj.contents:
+        for content in contents:
             for cc in campaign_contents:
                 if cc['id'] == content['content']:
                     result.append({
@@ -438,14 +487,32 @@ class CampaignReferenceSerializer(serializers.ModelSerializer):
             return []
         publishers_detail = []
         if obj.campaign.medium == Medium.TELEGRAM:
-            for content in obj.contents:
-                for detail in content.get('detail', []):
-                    publishers_detail.append(dict(
-                        publishers=Publisher.objects.filter(ref_id__in=detail.get('channel_ids', [])).values(
-                            'name', 'extra_data__tag'
-                        ),
-                        posts=detail.get('posts', []))
-                    )
+            details = [detail for content in obj.get_contents() for detail in content.get('detail', [])]
+            ref_ids = {int(ref_id) for detail in details for ref_id in detail.get('channel_ids', [])}
+
+            # publishers of all details are fetched with one query, each detail lists its publishers in id order
+            publishers = defaultdict(list)
+            if ref_ids:
+                for publisher in Publisher.objects.filter(ref_id__in=ref_ids).order_by('pk').values(
+                        'pk', 'ref_id', 'name', 'extra_data__tag'
+                ):
+                    publishers[publisher['ref_id']].append(publisher)
+
+            for detail in details:
+                detail_publishers = sorted(
+                    (
+                        publisher for ref_id in {int(ref_id) for ref_id in detail.get('channel_ids', [])}
+                        for publisher in publishers.get(ref_id, [])
+                    ),
+                    key=itemgetter('pk')
+                )
+                publishers_detail.append(dict(
+                    publishers=[
+                        {'name': publisher['name'], 'extra_data__tag': publisher['extra_data__tag']}
+                        for publisher in detail_publishers
+                    ],
+                    posts=detail.get('posts', []))
+                )
         return publishers_detail
 
 
@@ -483,6 +550,15 @@ class CampaignDashboardReportSerializer(serializers.Serializer):
             )
         return dict(created_time__date__gte=timezone.now() - timedelta(days=last_days))
 
+    def handle_date_range(self):
+        start_date = self.validated_data.get('start_date')
+        end_date = self.validated_data.get('end_date') or timezone.now().date()
+        last_days = self.validated_data.get('last_days') or 0
+
+        if start_date:
+            return start_date, end_date
+        return (timezone.now() - timedelta(days=last_days)).date(), None
+
     def handle_display_type(self):
         last_days = self.validated_data.get('last_days')
 
@@ -508,6 +584,73 @@ class CampaignDashboardReportSerializer(serializers.Serializer):
         return self.campaigns.count()
 
     def get_report(self, obj):
+        if not settings.DASHBOARD_REPORT_FROM_ROLLUP:
+            return self.get_legacy_report()
+
+        # the same campaigns and references as the legacy report, the campaigns and references created in the
+        # date range, read from the spend ledger and the hourly reports stored with each reference content
+        view_chart_type, cost_chart_type = self.CHART_LINE, self.CHART_AREA
+        start_date, end_date = self.handle_date_range()
+
+        spends = CampaignSpend.objects.filter(
+            campaign__in=self.campaigns,
+            content__cost_model_price__gt=0,
+            date__gte=start_date,
+        )
+        hourly_reports = CampaignReferenceHourlyReport.objects.filter(
+            campaign__in=self.campaigns,
+            cumulative_views__isnull=False,
+            reference_content__content__cost_model_price__gt=0,
+            reference_content__campaign_reference__ref_id__isnull=False,
+            reference_content__campaign_reference__created_time__date__gte=start_date,
+        )
+        if end_date:
+            spends = spends.filter(date__lte=end_date)
+            hourly_reports = hourly_reports.filter(
+                reference_content__campaign_reference__created_time__date__lte=end_date
+            )
+
+        totals = spends.aggregate(total_view=Coalesce(Sum('views'), 0), total_cost=Coalesce(Sum('cost'), 0))
+
+        if self.handle_display_type() == self.HOURLY:
+            hourly_reports = hourly_reports.annotate(
+                name=ExtractHour('bucket')
+            ).values('name').annotate(first_bucket=Min('bucket')).order_by('first_bucket')
+        else:
+            # grouped by the start day of each reference like the legacy report
+            hourly_reports = hourly_reports.annotate(
+                name=TruncDay(Lower(
+                    'reference_content__campaign_reference__schedule_range', output_field=models.DateTimeField()
+                ))
+            ).values('name').order_by('name')
+            cost_chart_type, view_chart_type = self.CHART_COLUMN, self.CHART_COLUMN  # type of charts
+        hourly_reports = hourly_reports.annotate(
+            total_views=Sum('cumulative_views'),
+            # integer division, the cost of each report is truncated like `compute_telegram_cost`
+            total_cost=Sum(ExpressionWrapper(
+                F('cumulative_views') * F('reference_content__content__cost_model_price') / 1000,
+                output_field=models.IntegerField()
+            )),
+        )
+
+        view_chart, cost_chart = [], []
+        for report in hourly_reports:
+            if self.handle_display_type() == self.HOURLY:
+                name = f"{report['name']}"
+            else:
+                name = JalaliDatetime(report['name']).strftime('%y-%m-%d')
+            view_chart.append({"name": name, "y": report['total_views']})
+            cost_chart.append({"name": name, "y": report['total_cost']})
+
+        return dict(
+            total_view=totals['total_view'],
+            total_cost=totals['total_cost'],
+            total_view_chart=dict(type=view_chart_type, data=view_chart),
+            total_cost_chart=dict(type=cost_chart_type, data=cost_chart),
+        )
+
+    def get_legacy_report(self):
+        """Computing the report from campaign references, used when the dashboard report rollup is disabled."""
         total_view = 0
         total_cost = 0
         temp_reports = []
@@ -518,7 +661,7 @@ class CampaignDashboardReportSerializer(serializers.Serializer):
         filter_kwargs.update(self.handle_filter_data())
         campaign_references = CampaignReference.objects.filter(
             **filter_kwargs
-        ).order_by('created_time')
+        ).prefetch_related('content_stats__hourly_reports').order_by('created_time')
 
         campaign_contents = CampaignContent.objects.filter(
             campaign_id__in=campaign_ids,
@@ -526,7 +669,7 @@ class CampaignDashboardReportSerializer(serializers.Serializer):
         )
 
         for cr in campaign_references:
-            for cr_content in cr.contents:
+            for cr_content in cr.get_contents():
                 for cc in campaign_contents:
                     if cr_content.get('content') == cc.id:
                         # total cost
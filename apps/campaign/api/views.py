@@ -1,5 +1,3 @@
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
@@ -17,8 +15,9 @@ from apps.campaign.api.serializers import (
 )
 from apps.campaign.models import Province, Campaign, CampaignContent, CampaignReference
 from apps.core.consts import CostModel
+from apps.core.utils.cache import cache_response
 from apps.core.views import BaseViewSet
-from apps.medium.models import CostModelPrice
+from apps.medium.catalog import catalog
 from apps.payments.models import Transaction
 
 
@@ -30,6 +29,10 @@ class ProvinceViewSet(BaseViewSet,
     queryset = Province.objects.all()
     serializer_class = ProvinceSerializer
 
+    @cache_response('provinces', per_owner=False)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 class CampaignViewSet(BaseViewSet,
                       mixins.ListModelMixin,
@@ -45,8 +48,12 @@ class CampaignViewSet(BaseViewSet,
 
     def get_queryset(self):
         if self.request.user.is_superuser:
-            return super().get_queryset()
-        return self.queryset.filter(owner=self.request.user)
+            queryset = super().get_queryset()
+        else:
+            queryset = self.queryset.filter(owner=self.request.user)
+        if self.action in ('list', 'retrieve'):
+            queryset = CampaignSerializer.prefetch(queryset)
+        return queryset
 
     def update(self, request, *args, **kwargs):
         return super().update(request, *args, **kwargs)
@@ -89,13 +96,13 @@ class CampaignViewSet(BaseViewSet,
     def cost_model(self, request, *args, **kwargs):
         campaign = self.get_object()
 
-        publishers = campaign.get_all_publishers(
+        publisher_ids = catalog.publisher_ids(
             campaign.publishers.values_list('id', flat=True),
-            campaign.categories.all()
+            campaign.categories.values_list('id', flat=True)
         )
         cost_model = kwargs.get('cost_model', CostModel.CPV)
 
-        return Response({'value': CostModelPrice.max_price(publishers, int(cost_model))})
+        return Response({'value': catalog.price_bounds(publisher_ids).get(int(cost_model), (0, 0))[1]})
 
     # Estimate campaign model prices like cpv, cpc and ... based on selected publishers or categories
     @action(detail=False, methods=['post'], url_path='estimate-actions', serializer_class=EstimateActionsSerializer)
@@ -106,51 +113,25 @@ class CampaignViewSet(BaseViewSet,
         publishers = serializer.data['publishers']
         categories = serializer.data['categories']
 
-        publishers = Campaign.get_all_publishers(publishers, categories)
-
         budget = serializer.data['budget']
 
-        cpv_price_max = CostModelPrice.max_price(publishers, CostModel.CPV)
-        cpv_price_min = CostModelPrice.min_price(publishers, CostModel.CPV)
-
-        cpc_price_max = CostModelPrice.max_price(publishers, CostModel.CPC)
-        cpc_price_min = CostModelPrice.min_price(publishers, CostModel.CPC)
-
-        cpi_price_max = CostModelPrice.max_price(publishers, CostModel.CPI)
-        cpi_price_min = CostModelPrice.min_price(publishers, CostModel.CPI)
-
-        cpr_price_max = CostModelPrice.max_price(publishers, CostModel.CPR)
-        cpr_price_min = CostModelPrice.min_price(publishers, CostModel.CPR)
-
-        cpv_min = budget // cpv_price_max if cpv_price_max else 0
-        cpv_max = budget // cpv_price_min if cpv_price_min else 0
-
-        cpc_min = budget // cpc_price_max if cpc_price_max else 0
-        cpc_max = budget // cpc_price_min if cpc_price_min else 0
-
-        cpi_min = budget // cpi_price_max if cpi_price_max else 0
-        cpi_max = budget // cpi_price_min if cpi_price_min else 0
-
-        cpr_min = budget // cpr_price_max if cpr_price_max else 0
-        cpr_max = budget // cpr_price_min if cpr_price_min else 0
+        price_bounds = catalog.price_bounds(catalog.publisher_ids(publishers, categories))
 
-        data = {
-            'cpv_min': cpv_min,
-            'cpv_max': cpv_max,
-            'cpc_min': cpc_min,
-            'cpc_max': cpc_max,
-            'cpi_min': cpi_min,
-            'cpi_max': cpi_max,
-            'cpr_min': cpr_min,
-            'cpr_max': cpr_max,
-        }
+        data = {}
+        for cost_model, name in (
+                (CostModel.CPV, 'cpv'), (CostModel.CPC, 'cpc'), (CostModel.CPI, 'cpi'), (CostModel.CPR, 'cpr')
+        ):
+            price_min, price_max = price_bounds.get(cost_model, (0, 0))
+            data[f'{name}_min'] = budget // price_max if price_max else 0
+            data[f'{name}_max'] = budget // price_min if price_min else 0
 
         return Response(data=data)
 
     @action(detail=True, methods=['get'], serializer_class=CampaignReferenceSerializer)
+    @cache_response('reports')
     def references(self, request, *args, **kwargs):
         instance = self.get_object()
-        campaign_references = instance.campaignreference_set.all()
+        campaign_references = instance.campaignreference_set.prefetch_related('content_stats__hourly_reports')
         serializer = self.get_serializer(campaign_references, many=True)
         return Response(serializer.data)
 
@@ -160,6 +141,7 @@ class CampaignViewSet(BaseViewSet,
         url_path='dashboard-report',
         serializer_class=CampaignDashboardReportSerializer
     )
+    @cache_response('reports')
     def dashboard_report(self, request, *args, **kwargs):
         data = request.query_params
         context = dict(owner_id=request.user.id)
@@ -183,7 +165,7 @@ class ContentViewSet(BaseViewSet,
     authentication_classes = (JWTAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = CampaignContentSerializer
-    queryset = CampaignContent.objects.exclude(is_hidden=True)
+    queryset = CampaignContent.objects.exclude(is_hidden=True).select_related('campaign')
     http_method_names = ['get', 'post', 'head', 'put']
     pagination_class = LimitOffsetPagination
 
@@ -194,7 +176,7 @@ class ContentViewSet(BaseViewSet,
 
 
 class CampaignReferenceViewSet(viewsets.GenericViewSet):
-    queryset = CampaignReference.objects.all()
+    queryset = CampaignReference.objects.prefetch_related('content_stats__hourly_reports')
     authentication_classes = (JWTAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = CampaignReferenceSerializer
@@ -204,8 +186,8 @@ class CampaignReferenceViewSet(viewsets.GenericViewSet):
             return super().get_queryset()
         return self.queryset.filter(campaign__owner=self.request.user)
 
-    @method_decorator(cache_page(60 * 10))
     @action(detail=True, methods=['get'], url_path='report')
+    @cache_response('reports')
     def report(self, request, *args, **kwargs):
         obj = self.get_object()
         serializer = self.get_serializer(obj)
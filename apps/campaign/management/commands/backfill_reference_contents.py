@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.campaign.models import CampaignContent, CampaignReference, CampaignReferenceContent
+
+
+class Command(BaseCommand):
+    help = 'Fill the campaign reference content stats and hourly reports from the `contents` json field.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('campaign_ids', nargs='*', type=int, help='backfill only these campaigns')
+
+    def handle(self, *args, **options):
+        campaign_references = CampaignReference.objects.filter(ref_id__isnull=False, schedule_range__isnull=False)
+        if options['campaign_ids']:
+            campaign_references = campaign_references.filter(campaign_id__in=options['campaign_ids'])
+
+        stored_count = 0
+        for campaign_reference in campaign_references.iterator():
+            if not isinstance(campaign_reference.contents, list):
+                continue
+            campaign_contents = CampaignContent.objects.filter(campaign_id=campaign_reference.campaign_id).in_bulk(
+                [content.get('content') for content in campaign_reference.contents]
+            )
+            with transaction.atomic():
+                for content in campaign_reference.contents:
+                    campaign_content = campaign_contents.get(content.get('content'))
+                    if campaign_content is None:
+                        continue
+                    CampaignReferenceContent.objects.store(campaign_reference, campaign_content, content)
+                    stored_count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{stored_count} campaign reference contents stored.'))
@@ -0,0 +1,100 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from apps.campaign.models import Campaign
+from apps.core.consts import CostModel
+from apps.medium.catalog import catalog
+from apps.medium.consts import Medium
+from apps.medium.models import Category, CostModelPrice, Publisher
+
+COST_MODELS = (CostModel.CPV, CostModel.CPC, CostModel.CPI, CostModel.CPR)
+
+
+class Command(BaseCommand):
+    help = 'Compare the per cost model price aggregates of estimate-actions with the grouped query and the ' \
+           'in-memory catalog index against a seeded publisher catalog. Seeded rows are rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--publishers', type=int, default=10000)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            publisher_ids, category_ids = self.seed(options['publishers'], options['categories'])
+            selected_publishers = random.sample(publisher_ids, min(100, len(publisher_ids)))
+            selected_categories = random.sample(category_ids, min(5, len(category_ids)))
+
+            def legacy():
+                publishers = Campaign.get_all_publishers(selected_publishers, selected_categories)
+                return {
+                    cost_model: (
+                        CostModelPrice.min_price(publishers, cost_model),
+                        CostModelPrice.max_price(publishers, cost_model),
+                    )
+                    for cost_model in COST_MODELS
+                }
+
+            def grouped():
+                publishers = Campaign.get_all_publishers(selected_publishers, selected_categories)
+                bounds = CostModelPrice.price_bounds(publishers)
+                return {cost_model: bounds.get(cost_model, (0, 0)) for cost_model in COST_MODELS}
+
+            def in_memory():
+                bounds = catalog.price_bounds(catalog.publisher_ids(selected_publishers, selected_categories))
+                return {cost_model: bounds.get(cost_model, (0, 0)) for cost_model in COST_MODELS}
+
+            catalog.invalidate()
+            catalog.index()
+
+            results = []
+            for name, func in (('legacy', legacy), ('grouped', grouped), ('catalog', in_memory)):
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.monotonic()
+                    for _ in range(options['repeat']):
+                        result = func()
+                    elapsed = (time.monotonic() - start) / options['repeat']
+                results.append(result)
+                self.stdout.write(
+                    f'{name:>8} - queries: {len(queries) // options["repeat"]} - elapsed: {elapsed * 1000:.2f}ms'
+                )
+
+            for result in results[1:]:
+                if result != results[0]:
+                    self.stderr.write(f'results differ: {results[0]} != {result}')
+            transaction.set_rollback(True)
+        catalog.invalidate()
+
+    def seed(self, publishers_count, categories_count):
+        categories = Category.objects.bulk_create(
+            Category(medium=Medium.TELEGRAM, title=f'benchmark {i}', display_text=f'benchmark {i}')
+            for i in range(categories_count)
+        )
+        prices = CostModelPrice.objects.bulk_create(
+            CostModelPrice(
+                medium=Medium.TELEGRAM,
+                cost_model=cost_model,
+                grade=f'benchmark {grade}',
+                publisher_price=100 * grade + 100,
+                advertiser_price=100 * grade + 150 + cost_model,
+            )
+            for cost_model in COST_MODELS for grade in range(5)
+        )
+        publishers = Publisher.objects.bulk_create(
+            Publisher(medium=Medium.TELEGRAM, name=f'benchmark {i}', status=Publisher.STATUS_APPROVED, is_enable=True)
+            for i in range(publishers_count)
+        )
+
+        Publisher.categories.through.objects.bulk_create(
+            Publisher.categories.through(publisher_id=publisher.id, category_id=category.id)
+            for publisher in publishers for category in random.sample(categories, 2)
+        )
+        Publisher.cost_models.through.objects.bulk_create(
+            Publisher.cost_models.through(publisher_id=publisher.id, costmodelprice_id=price.id)
+            for publisher in publishers for price in random.sample(prices, 3)
+        )
+        return [publisher.id for publisher in publishers], [category.id for category in categories]
@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from services.adbot_stub import AdBotStubServer
+from services.utils import custom_request, run_concurrently
+
+
+class Command(BaseCommand):
+    help = 'Compare serial and concurrent campaign provisioning round-trips against a local AdBot stub server.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--campaigns', type=int, default=20)
+        parser.add_argument('--contents', type=int, default=3)
+        parser.add_argument('--latency', type=float, default=0.05, help='seconds added to each stub response')
+        parser.add_argument('--width', type=int, default=settings.CAMPAIGN_PROVISIONING_CONCURRENCY)
+
+    def handle(self, *args, **options):
+        with AdBotStubServer(latency=options['latency']) as server:
+            url = f'{server.url}/api/v1'
+
+            def provision(index, contents):
+                # the same round-trips as `TelegramCampaignServices.create_telegram_campaign`
+                ref_id = custom_request(f'{url}/campaigns/', json={'title': f'campaign {index}'}).json()['id']
+                custom_request(f'{url}/files/', json={'campaign': ref_id, 'telegram_file_hash': 'hash'})
+                for content_index in range(contents):
+                    content_id = custom_request(
+                        f'{url}/contents/', json={'campaign': ref_id, 'display_text': f'content {content_index}'}
+                    ).json()['id']
+                    custom_request(f'{url}/files/', json={'campaign_content': content_id, 'telegram_file_hash': 'hash'})
+                custom_request(f'{url}/campaigns/{ref_id}/', 'patch', json={'is_enable': True})
+
+            jobs = [(index, options['contents']) for index in range(options['campaigns'])]
+            for width in (1, options['width']):
+                start = time.monotonic()
+                results = run_concurrently(provision, jobs, width)
+                elapsed = time.monotonic() - start
+                failed = sum(1 for _, exc in results if exc is not None)
+                self.stdout.write(
+                    f'width: {width:>3} - campaigns: {len(jobs)} - failed: {failed} - elapsed: {elapsed:.3f}s'
+                )
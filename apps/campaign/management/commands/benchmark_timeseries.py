@@ -0,0 +1,37 @@
+import datetime
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from apps.campaign.testing import cumulative_report, legacy_hourly_series
+from apps.campaign.timeseries import hourly_series
+
+
+class Command(BaseCommand):
+    help = 'Compare the hourly report series of the legacy sort_hours based loop and apps.campaign.timeseries ' \
+           'on random campaign reference reports.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=18, help='length of the campaign reference ranges')
+        parser.add_argument('--reports', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        now = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+        reports = []
+        for _ in range(options['reports']):
+            start_date = now + datetime.timedelta(hours=random.randint(0, 23))
+            end_date = start_date + datetime.timedelta(hours=options['hours'])
+            hourly = cumulative_report(start_date, random.randint(1, options['hours'] + 1))
+            reports.append((hourly, start_date, end_date))
+
+        mismatches = sum(1 for report in reports if legacy_hourly_series(*report) != hourly_series(*report))
+        for name, func in (('legacy', legacy_hourly_series), ('timeseries', hourly_series)):
+            elapsed = min(timeit.repeat(
+                lambda: [func(*report) for report in reports], number=1, repeat=options['repeat']
+            ))
+            self.stdout.write(
+                f'{name:>10} - reports: {len(reports)} - per report: {elapsed / len(reports) * 1e6:.1f}us'
+            )
+        self.stdout.write(f'mismatched series: {mismatches}')
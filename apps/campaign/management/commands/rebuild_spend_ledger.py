@@ -0,0 +1,53 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.campaign.models import CampaignContent, CampaignReference, CampaignSpend
+from apps.campaign.utils import compute_telegram_cost
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the campaign spend ledger from the views stored in campaign references.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('campaign_ids', nargs='*', type=int, help='rebuild only these campaigns')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        campaign_references = CampaignReference.objects.filter(ref_id__isnull=False).only(
+            'campaign_id', 'created_time', 'contents'
+        )
+        spends = CampaignSpend.objects.all()
+        contents = CampaignContent.objects.only('id', 'campaign_id', 'cost_model_price')
+        if options['campaign_ids']:
+            campaign_references = campaign_references.filter(campaign_id__in=options['campaign_ids'])
+            spends = spends.filter(campaign_id__in=options['campaign_ids'])
+            contents = contents.filter(campaign_id__in=options['campaign_ids'])
+        contents = {content.id: content for content in contents}
+
+        # (campaign id, date, content id) => [views, cost]
+        ledger = defaultdict(lambda: [0, 0])
+        for campaign_reference in campaign_references.iterator():
+            if not isinstance(campaign_reference.contents, list):
+                continue
+            for obj in campaign_reference.contents:
+                content = contents.get(obj.get('content'))
+                if content is None or content.campaign_id != campaign_reference.campaign_id:
+                    continue
+                views = obj.get('views', 0)
+                row = ledger[(campaign_reference.campaign_id, campaign_reference.created_time.date(), content.id)]
+                row[0] += views
+                row[1] += compute_telegram_cost(views, content.cost_model_price)
+
+        with transaction.atomic():
+            deleted, _ = spends.delete()
+            CampaignSpend.objects.bulk_create(
+                [
+                    CampaignSpend(campaign_id=campaign_id, date=date, content_id=content_id, views=views, cost=cost)
+                    for (campaign_id, date, content_id), (views, cost) in ledger.items()
+                ],
+                batch_size=options['batch_size'],
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'{deleted} spend rows removed, {len(ledger)} spend rows created.'))
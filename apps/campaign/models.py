@@ -1,7 +1,9 @@
 import datetime
 
 from django.contrib.postgres.fields import JSONField, DateTimeRangeField
-from django.db import models
+from django.contrib.postgres.indexes import GistIndex
+from django.db import models, transaction
+from django.db.models import F, Sum
 from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
@@ -9,12 +11,14 @@ from django.conf import settings
 
 from apps.core.consts import CostModel
 from apps.core.models import File
+from apps.core.utils.get_file import get_file
 from apps.device.consts import ServiceProvider
 from apps.device.models import Device
+from apps.medium.catalog import catalog
 from apps.medium.consts import Medium
-from apps.medium.models import Publisher, Category
+from apps.medium.models import Category, CostModelPrice, Publisher
 
-from .utils import compute_telegram_cost
+from .utils import compute_telegram_cost, hour_buckets
 
 
 def json_default():
@@ -36,28 +40,85 @@ class CampaignManager(models.Manager):
             start_date__lte=timezone.now().date(),
         )
 
+    def with_spent(self):
+        spent = CampaignSpend.objects.filter(
+            campaign=models.OuterRef('pk')
+        ).values('campaign').annotate(spent=Sum('cost')).values('spent')
+        return self.get_queryset().annotate(spent=Coalesce(models.Subquery(spent), 0))
 
-class CampaignReferenceManager(models.Manager):
+    def finished(self):
+        """Approved and enabled campaigns which are expired or have spent their total budget."""
+        return self.with_spent().filter(
+            models.Q(end_date__lt=timezone.now().date()) | models.Q(spent__gte=F('total_budget')),
+            is_enable=True,
+            status=Campaign.STATUS_APPROVED,
+            start_date__lte=timezone.now().date(),
+        )
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.live_conditions = dict(
-            ref_id__isnull=False,
-            schedule_range__startswith__lte=timezone.now(),
-            schedule_range__endswith__gte=timezone.now()
+
+class CampaignSpendManager(models.Manager):
+
+    def cost(self, **filters):
+        return self.get_queryset().filter(**filters).aggregate(cost=Coalesce(Sum('cost'), 0))['cost']
+
+    def record(self, campaign_ref, content, views, previous_views=0):
+        """
+            Adding the difference between `previous_views` and `views` of a content in a campaign reference
+            to the spend of the reference's day.
+        """
+        cost = compute_telegram_cost(views, content.cost_model_price) - \
+            compute_telegram_cost(previous_views, content.cost_model_price)
+        views -= previous_views
+        if views == 0 and cost == 0:
+            return
+
+        spend, _ = self.get_or_create(
+            campaign_id=campaign_ref.campaign_id,
+            content=content,
+            date=campaign_ref.created_time.date(),
         )
+        self.get_queryset().filter(pk=spend.pk).update(views=F('views') + views, cost=F('cost') + cost)
+
+
+class StatementNow(models.Func):
+    """
+    Start time of the current statement, unlike `Now` it is not frozen for the whole transaction
+    and it is still stable within the statement, so it can be used for index scans.
+    """
+    template = 'STATEMENT_TIMESTAMP()'
+    output_field = models.DateTimeField()
+
+
+class CampaignReferenceQuerySet(models.QuerySet):
+    @staticmethod
+    def live_q():
+        # evaluated by the database at query time, backed by the `campaignref_live_idx` range index
+        return models.Q(ref_id__isnull=False, schedule_range__contains=StatementNow())
 
     def live(self):
-        return self.get_queryset().filter(**self.live_conditions)
+        return self.filter(self.live_q())
+
+    def annotate_live(self, name='is_live'):
+        return self.annotate(**{
+            name: models.Case(
+                models.When(self.live_q(), then=models.Value(True)),
+                default=models.Value(False),
+                output_field=models.BooleanField(),
+            )
+        })
 
     def monitor_report(self):
-        return self.get_queryset().filter(
+        # ranges ending in the last 3 hours or later, as an overlap so the range index can be used
+        return self.filter(
             ref_id__isnull=False,
             report_time__isnull=True,
-            schedule_range__endswith__gte=timezone.now() - datetime.timedelta(hours=3),
+            schedule_range__overlap=(timezone.now() - datetime.timedelta(hours=3), None),
         )
 
 
+CampaignReferenceManager = models.Manager.from_queryset(CampaignReferenceQuerySet)
+
+
 # --- Models ---
 class Province(models.Model):
     name = models.CharField(max_length=50, unique=True)
@@ -117,6 +178,14 @@ class Campaign(models.Model):
 
     class Meta:
         ordering = ('-created_time',)
+        indexes = [
+            # `CampaignManager.live` and `finished`, status 2 is `STATUS_APPROVED`
+            models.Index(
+                fields=['medium', 'start_date', 'end_date'],
+                name='campaign_live_idx',
+                condition=models.Q(status=2, is_enable=True),
+            ),
+        ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -127,57 +196,55 @@ class Campaign(models.Model):
 
     @classmethod
     def get_all_publishers(cls, publishers_id, categories, cost_mode=None):
+        """
+            Queryset of the selected publishers and publishers of the selected categories, the categories are
+            resolved in SQL. `catalog.publisher_ids` gives the same publishers' ids without a query.
+        """
         _qs = Publisher.objects.filter(
-            models.Q(id__in=publishers_id) | models.Q(categories__in=categories),
+            models.Q(id__in=publishers_id) |
+            models.Q(id__in=Publisher.categories.through.objects.filter(
+                category__in=categories
+            ).values('publisher_id'))
         )
         if cost_mode:
-            _qs = _qs.filter(cost_models__cost_model=cost_mode)
-
-        return _qs.distinct()
+            _qs = _qs.filter(id__in=Publisher.cost_models.through.objects.filter(
+                costmodelprice__cost_model=cost_mode
+            ).values('publisher_id'))
+        return _qs
 
     def is_finished(self):
         return (self.end_date and self.end_date < timezone.now().date()) or (self.total_cost >= self.total_budget)
 
     def update_final_publishers(self):
-        # TODO Implement This
-        # publishers_by_categories_ids = Publisher.get_by_categories(
-        #     categories=instance.categories.all()
-        # ).values_list('id', flat=True)
-        # print(publishers_by_categories_ids)
-        # current_publisher_ids = instance.publisher_price.all().values_list('publisher_id')
-        # inserting_publisher = set(current_publisher_ids) - set(publishers_by_categories_ids)
-        #
-        # for publisher in Publisher.objects.filter(id__in=inserting_publisher):
-        #     try:
-        #         price = publisher.cost_models.filter(
-        #                 cost_model=CostModel.CPV
-        #             ).order_by('-publisher_price').first().publisher_price
-        #     except:
-        #         price = 0
-        #     instance.publisher_price.create(
-        #         publisher=publisher,
-        #         publisher_price=price
-        #     )
-        #
-        # current_publisher_ids = instance.publisher_price.all().values_list('publisher_id')
-        # deleting_publisher_ids = set(publishers_by_categories_ids) - set(current_publisher_ids)
-        # instance.publisher_price.filter(publisher_id__in=deleting_publisher_ids).delete()
-        self.finalpublisher_set.all().delete()
-
-        publishers = self.get_all_publishers(
-            publishers_id=self.publishers.values_list('id', flat=True),
-            categories=self.categories.all(),
-            cost_mode=CostModel.CPV
-        )
-
-        for publisher in publishers:
-            try:
-                price = publisher.cost_models.filter(
-                        cost_model=CostModel.CPV
-                    ).order_by('-publisher_price').first().publisher_price
-            except:
-                continue
-            self.finalpublisher_set.create(publisher=publisher, tariff=price)
+        """
+        Setting the final publishers of the campaign to its publishers and the publishers of its categories
+        having a CPV price, with their max CPV publisher price as tariff. Only the changed rows are written.
+        """
+        with transaction.atomic():
+            # resolved in SQL, the catalog index of this process may not have seen a publisher change yet
+            publishers = self.get_all_publishers(
+                self.publishers.values_list('id', flat=True), self.categories.values_list('id', flat=True)
+            )
+            tariffs = dict(
+                CostModelPrice.objects.filter(
+                    cost_model=CostModel.CPV, publisher__in=publishers
+                ).values('publisher').annotate(tariff=models.Max('publisher_price')).values_list('publisher', 'tariff')
+            )
+
+            stale_ids = []
+            for final_id, publisher_id, tariff in self.finalpublisher_set.values_list('id', 'publisher_id', 'tariff'):
+                if tariffs.get(publisher_id) == tariff:
+                    # already up to date, a duplicate row of the same publisher is removed
+                    tariffs.pop(publisher_id)
+                else:
+                    stale_ids.append(final_id)
+
+            if stale_ids:
+                self.finalpublisher_set.filter(id__in=stale_ids).delete()
+            FinalPublisher.objects.bulk_create(
+                FinalPublisher(campaign=self, publisher_id=publisher_id, tariff=tariff)
+                for publisher_id, tariff in tariffs.items()
+            )
 
     @property
     def max_cost_model_price(self):
@@ -196,32 +263,11 @@ class Campaign(models.Model):
 
     @property
     def total_cost(self):
-        cost = 0
-        for campaign_reference in self.campaignreference_set.filter(ref_id__isnull=False):
-            if isinstance(campaign_reference.contents, list):
-                for obj in campaign_reference.contents:
-                    try:
-                        content = self.contents.get(pk=obj['content'])
-                        cost += compute_telegram_cost(obj['views'], content.cost_model_price)
-                    except:
-                        continue
-        return cost
+        return CampaignSpend.objects.cost(campaign=self)
 
     @property
     def today_cost(self):
-        cost = 0
-        for campaign_reference in self.campaignreference_set.filter(
-                created_time__date=timezone.now().date(),
-                ref_id__isnull=False
-        ):
-            if isinstance(campaign_reference.contents, list):
-                for obj in campaign_reference.contents:
-                    try:
-                        content = self.contents.get(pk=obj['content'])
-                        cost += compute_telegram_cost(obj['views'], content.cost_model_price)
-                    except:
-                        continue
-        return cost
+        return CampaignSpend.objects.cost(campaign=self, date=timezone.now().date())
 
     def approve_validate(self, status):
         if self.medium == Medium.TELEGRAM:
@@ -264,6 +310,148 @@ class CampaignReference(models.Model):
 
     objects = CampaignReferenceManager()
 
+    class Meta:
+        indexes = [
+            # `CampaignReferenceManager.live`
+            GistIndex(
+                fields=['schedule_range'],
+                name='campaignref_live_idx',
+                condition=models.Q(ref_id__isnull=False),
+            ),
+            # `CampaignReferenceManager.monitor_report`
+            GistIndex(
+                fields=['schedule_range'],
+                name='campaignref_monitor_idx',
+                condition=models.Q(ref_id__isnull=False, report_time__isnull=True),
+            ),
+        ]
+
+    def get_contents(self):
+        """
+            Contents of the reference in the shape of the `contents` json field, with the stored content stats
+            merged over the items they exist for. Contents not reported yet keep their json item.
+        """
+        content_stats = {content_stat.content_id: content_stat for content_stat in self.content_stats.all()}
+        if not content_stats:
+            return self.contents
+
+        contents = []
+        for content in self.contents:
+            content_stat = content_stats.pop(content.get('content'), None)
+            contents.append(dict(content, **content_stat.to_json()) if content_stat is not None else content)
+        # stats of contents missing from the json field
+        contents.extend(content_stat.to_json() for content_stat in content_stats.values())
+        return contents
+
+
+class CampaignReferenceContentManager(models.Manager):
+
+    def store(self, campaign_ref, campaign_content, content):
+        """Storing a content item of the reference's `contents` json field with its hourly series."""
+        reference_content, _ = self.update_or_create(
+            campaign_reference=campaign_ref,
+            content=campaign_content,
+            defaults=dict(
+                campaign_id=campaign_ref.campaign_id,
+                ref_id=content.get('ref_id'),
+                views=content.get('views', 0),
+                cost=compute_telegram_cost(content.get('views', 0), campaign_content.cost_model_price),
+                detail=content.get('detail', []),
+            )
+        )
+
+        buckets = hour_buckets(campaign_ref.schedule_range.lower, campaign_ref.schedule_range.upper)
+        hourly_reports = {}
+        for key, field in (('graph_hourly_cumulative', 'cumulative_views'), ('graph_hourly_view', 'views')):
+            for report in content.get(key, []):
+                bucket = buckets.get(str(report['name']))
+                if bucket is None:
+                    continue
+                hourly_report = hourly_reports.setdefault(bucket, CampaignReferenceHourlyReport(
+                    reference_content=reference_content,
+                    campaign_id=campaign_ref.campaign_id,
+                    bucket=bucket,
+                ))
+                setattr(hourly_report, field, report['y'])
+
+        reference_content.hourly_reports.all().delete()
+        CampaignReferenceHourlyReport.objects.bulk_create(hourly_reports.values())
+        return reference_content
+
+
+class CampaignReferenceContent(models.Model):
+    """Reported views and cost of a content in a campaign reference."""
+    campaign_reference = models.ForeignKey(CampaignReference, on_delete=models.CASCADE, related_name='content_stats')
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE)
+    content = models.ForeignKey('CampaignContent', on_delete=models.CASCADE)
+    ref_id = models.IntegerField(null=True, blank=True)
+    views = models.IntegerField(_("views"), default=0)
+    cost = models.IntegerField(_("cost"), default=0)
+    detail = JSONField(default=list)
+
+    objects = CampaignReferenceContentManager()
+
+    class Meta:
+        ordering = ['pk']
+        unique_together = ('campaign_reference', 'content')
+        indexes = [
+            models.Index(fields=['campaign', 'content']),
+        ]
+
+    def to_json(self):
+        hourly_reports = list(self.hourly_reports.all())
+        return {
+            'content': self.content_id,
+            'ref_id': self.ref_id,
+            'views': self.views,
+            'detail': self.detail,
+            'graph_hourly_cumulative': [
+                dict(y=report.cumulative_views, name=f'{report.bucket.hour}')
+                for report in hourly_reports if report.cumulative_views is not None
+            ],
+            'graph_hourly_view': [
+                dict(y=report.views, name=f'{report.bucket.hour}')
+                for report in hourly_reports if report.views is not None
+            ],
+        }
+
+
+class CampaignReferenceHourlyReport(models.Model):
+    """Cumulative and per hour views of a content in a campaign reference."""
+    reference_content = models.ForeignKey(
+        CampaignReferenceContent,
+        on_delete=models.CASCADE,
+        related_name='hourly_reports'
+    )
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE)
+    bucket = models.DateTimeField(_("bucket"))
+    cumulative_views = models.IntegerField(_("cumulative views"), null=True, blank=True)
+    views = models.IntegerField(_("views"), null=True, blank=True)
+
+    class Meta:
+        ordering = ['bucket']
+        unique_together = ('reference_content', 'bucket')
+        indexes = [
+            models.Index(fields=['campaign', 'bucket']),
+        ]
+
+
+class CampaignSpend(models.Model):
+    """Daily spend of each campaign content, updated incrementally whenever new views are reported."""
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='spends')
+    content = models.ForeignKey('CampaignContent', on_delete=models.CASCADE, related_name='spends')
+    date = models.DateField(_("date"))
+    views = models.IntegerField(_("views"), default=0)
+    cost = models.IntegerField(_("cost"), default=0)
+
+    objects = CampaignSpendManager()
+
+    class Meta:
+        unique_together = ('campaign', 'date', 'content')
+
+    def __str__(self):
+        return f"{self.campaign_id} - {self.date} - {self.cost}"
+
 
 class TargetDevice(models.Model):
     SERVICE_PROVIDER_MTN = 1
@@ -303,10 +491,7 @@ class CampaignContent(models.Model):
 
     @property
     def file(self):
-        try:
-            return File.objects.get(pk=self.data.get('file', None)).file
-        except File.DoesNotExist:
-            return None
+        return get_file(self.data.get('file', None))
 
     @property
     def campaign_medium(self):
@@ -342,6 +527,9 @@ class CampaignSchedule(models.Model):
 
     class Meta:
         verbose_name = 'Schedule'
+        indexes = [
+            models.Index(fields=['week_day', 'start_time', 'end_time'], name='campaignschedule_window_idx'),
+        ]
 
 
 class TelegramCampaign(models.Model):
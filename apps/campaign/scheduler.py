@@ -0,0 +1,111 @@
+import heapq
+import logging
+import threading
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from apps.campaign.models import Campaign, CampaignSchedule
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'campaign:schedule:version'
+
+ScheduleWindow = namedtuple('ScheduleWindow', ['start', 'end', 'campaign_id'])
+
+
+def schedule_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_schedule_version():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+class ScheduleTimeline(object):
+    """
+    Today's schedule windows of the live campaigns of `mediums`, sorted by start time.
+    The timeline is rebuilt when the day changes or the shared schedule version is bumped, a tick between
+    rebuilds only pops the windows that are due. It is also rebuilt once older than `SCHEDULE_TIMELINE_REFRESH`
+    seconds, a safety net for changes that did not bump the version.
+    """
+
+    def __init__(self, mediums, clock=timezone.now):
+        self.mediums = mediums
+        self.clock = clock
+        self._heap = []
+        self._fired = set()
+        self._date = None
+        self._version = None
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def build(self, now):
+        schedules = CampaignSchedule.objects.filter(
+            campaign__in=Campaign.objects.live().filter(medium__in=self.mediums),
+            week_day=now.date().weekday(),
+        ).values_list('campaign_id', 'start_time', 'end_time')
+
+        if self._date != now.date():
+            self._fired.clear()
+
+        heap = []
+        for campaign_id, start_time, end_time in schedules:
+            window = ScheduleWindow(
+                datetime.combine(now.date(), start_time), datetime.combine(now.date(), end_time), campaign_id
+            )
+            # windows already handed out before a rebuild are not handed out again
+            if window.end > now and window not in self._fired:
+                heap.append(window)
+        heapq.heapify(heap)
+
+        self._heap = heap
+        self._date = now.date()
+        self._built_at = now
+        logger.debug(f'[schedule timeline built]-[mediums: {self.mediums}]-[windows: {len(heap)}]')
+
+    def due(self):
+        """Popping the windows started until now, the ones already ended are dropped."""
+        now = self.clock()
+        with self._lock:
+            version = schedule_version()
+            if self._date != now.date() or self._version != version or \
+                    now - self._built_at >= timedelta(seconds=settings.SCHEDULE_TIMELINE_REFRESH):
+                self._version = version
+                self.build(now)
+
+            windows = []
+            while self._heap and self._heap[0].start <= now:
+                window = heapq.heappop(self._heap)
+                if window.end > now:
+                    self._fired.add(window)
+                    windows.append(window)
+            return windows
+
+    def retry(self, window):
+        """
+        Putting back a window that did not produce a live campaign reference, it is due again on the next tick
+        while it has not ended.
+        """
+        with self._lock:
+            self._fired.discard(window)
+            heapq.heappush(self._heap, window)
+
+
+_timelines = {}
+_timelines_lock = threading.Lock()
+
+
+def get_timeline(name, mediums):
+    with _timelines_lock:
+        if name not in _timelines:
+            _timelines[name] = ScheduleTimeline(mediums)
+        return _timelines[name]
@@ -2,13 +2,19 @@ import logging
 
 from datetime import timedelta, datetime, time
 
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Count, F
 from django.utils import timezone
 from django.conf import settings
 
-from apps.core.utils.get_file import get_file
-from apps.campaign.models import CampaignSchedule, CampaignReference, TelegramCampaign
-from services.utils import file_type, custom_request
+from apps.core.models import File
+from apps.core.utils.get_file import FileResolver, get_file
+from apps.campaign.models import Campaign, CampaignReference, TelegramCampaign
+from apps.campaign.scheduler import get_timeline
+from apps.medium.consts import Medium
+from apps.payments.models import Transaction
+from services.http import MultipartFileBody, http_client
+from services.utils import RequestError, file_size, file_type, custom_request, run_concurrently
 
 logger = logging.getLogger(__name__)
 
@@ -109,12 +115,7 @@ class InstagramCampaignServices(object):
             logger.error(f"[creating instagram campaign failed]-[campaign id: {campaign.id}]")
             return
 
-        if CampaignReference.objects.filter(
-                campaign=campaign,
-                ref_id__isnull=False,
-                schedule_range__startswith__lte=timezone.now(),
-                schedule_range__endswith__gte=timezone.now(),
-        ).exists():
+        if CampaignReference.objects.live().filter(campaign=campaign).exists():
             return
 
         try:
@@ -146,8 +147,7 @@ class InstagramCampaignServices(object):
                 campaign_ref.save()
                 return campaign_ref
         except Exception as e:
-            campaign.error_count += 1
-            campaign.save()
+            CampaignService.increase_error_count(campaign)
             logger.error(f'[creating instagram campaign failed]-[campaign id: {campaign.id}]-'
                          f'[error count:{campaign.error_count}]-[exc: {e}]')
             raise e
@@ -162,6 +162,12 @@ class TelegramCampaignServices(object):
     CONTENT_URL = f'{settings.ADBOT_API_URL}/api/v1/contents/'
     FILE_URL = f'{settings.ADBOT_API_URL}/api/v1/files/'
     CHANNELS_URL = f'{settings.ADBOT_API_URL}/api/v1/channels/'
+    CONTENT_BULK_URL = f'{settings.ADBOT_API_URL}/api/v1/contents/bulk/'
+    FILE_BULK_URL = f'{settings.ADBOT_API_URL}/api/v1/files/bulk/'
+
+    BULK_UNSUPPORTED_STATUS_CODES = (404, 405, 501)
+    # bulk endpoints the remote answered as unsupported, kept for the life of the process
+    _bulk_unsupported_urls = set()
 
     def create_campaign(self, campaign, start_time, end_time, status):
         logger.debug(
@@ -186,12 +192,7 @@ class TelegramCampaignServices(object):
         response = custom_request(self.CAMPAIGN_URL, json=data, headers=self.HEADERS)
         return response.json()['id']
 
-    def create_content(self, content, campaign_id):
-        logger.debug(
-            f"[creating telegram content]-[content id: {content.id}]-[campaign id: {campaign_id}]"
-            f"-[URL: {self.CONTENT_URL}]"
-        )
-
+    def build_content_payload(self, content, campaign_id):
         if 'post_link' in content.data:
             data = dict(
                 campaign=campaign_id,
@@ -245,31 +246,168 @@ class TelegramCampaignServices(object):
                 mother_channel=content.data.get('mother_channel', None),
                 view_type=content.data.get('view_type'),
             )
+        return data
 
+    def create_content(self, content, campaign_id):
+        logger.debug(
+            f"[creating telegram content]-[content id: {content.id}]-[campaign id: {campaign_id}]"
+            f"-[URL: {self.CONTENT_URL}]"
+        )
+        data = self.build_content_payload(content, campaign_id)
         response = custom_request(self.CONTENT_URL, json=data, headers=self.HEADERS)
         return response.json()['id']
 
-    def create_file(self, file, campaign_id=None, content_id=None, telegram_file_hash=None):
-        filetype = file_type(file.name)
+    def create_contents(self, contents, campaign_id):
+        """
+        Creating `contents` on the remote campaign with one bulk request, falling back to concurrent
+        per content requests when the remote does not support it.
+        Returns a `(content ref id, exception)` pair for each content, in the order of `contents`.
+        """
+        results = [None] * len(contents)
+        payloads = []
+        for index, content in enumerate(contents):
+            try:
+                payloads.append((index, self.build_content_payload(content, campaign_id)))
+            except Exception as e:
+                results[index] = (None, e)
 
-        logger.debug(
-            f"[creating telegram file]-[file: {file.name}]-[file type: {filetype}]-[content id: {content_id}]"
-            f"-[telegram file hash: {telegram_file_hash}]-[URL: {self.FILE_URL}]"
-        )
+        if payloads and self.bulk_supported(self.CONTENT_BULK_URL):
+            logger.debug(
+                f"[creating telegram contents]-[campaign id: {campaign_id}]-[count: {len(payloads)}]"
+                f"-[URL: {self.CONTENT_BULK_URL}]"
+            )
+            try:
+                response = self.bulk_request(self.CONTENT_BULK_URL, [data for _, data in payloads])
+            except Exception as e:
+                for index, _ in payloads:
+                    results[index] = (None, e)
+                return results
+            if response is not None:
+                created = response.json()
+                if not isinstance(created, list) or len(created) != len(payloads):
+                    # the created objects can not be matched with the contents by their position
+                    e = RequestError(
+                        f'bulk response has {len(created) if isinstance(created, list) else "no"} items '
+                        f'for {len(payloads)} contents'
+                    )
+                    logger.error(
+                        f"[creating telegram contents failed]-[campaign id: {campaign_id}]"
+                        f"-[URL: {self.CONTENT_BULK_URL}]-[exc: {e}]"
+                    )
+                    for index, _ in payloads:
+                        results[index] = (None, e)
+                    return results
+                for (index, _), obj in zip(payloads, created):
+                    results[index] = (obj['id'], None)
+                return results
+
+        def create(index, data):
+            logger.debug(
+                f"[creating telegram content]-[content id: {contents[index].id}]-[campaign id: {campaign_id}]"
+                f"-[URL: {self.CONTENT_URL}]"
+            )
+            return custom_request(self.CONTENT_URL, json=data, headers=self.HEADERS).json()['id']
+
+        for (index, _), result in zip(
+                payloads, run_concurrently(create, payloads, settings.CAMPAIGN_CONTENT_UPLOAD_CONCURRENCY)
+        ):
+            results[index] = result
+        return results
+
+    def build_file_payload(self, file, campaign_id=None, content_id=None, telegram_file_hash=None):
         data = dict(
             name=file.name,
-            file_type=filetype,
+            file_type=file_type(file.name),
             telegram_file_hash=telegram_file_hash
         )
         if campaign_id:
             data['campaign'] = campaign_id
         if content_id:
             data['campaign_content'] = content_id
+        return data
+
+    def create_file(self, file, campaign_id=None, content_id=None, telegram_file_hash=None):
+        data = self.build_file_payload(file, campaign_id, content_id, telegram_file_hash)
 
+        logger.debug(
+            f"[creating telegram file]-[file: {file.name}]-[file type: {data['file_type']}]-[content id: {content_id}]"
+            f"-[telegram file hash: {telegram_file_hash}]-[URL: {self.FILE_URL}]"
+        )
         if telegram_file_hash:
             custom_request(self.FILE_URL, json=data, headers=self.HEADERS)
+            http_client.record_upload(self.FILE_URL, skipped=file_size(file))
         else:
-            custom_request(self.FILE_URL, data=data, files={'file': file}, headers=self.HEADERS)
+            body = MultipartFileBody(data, 'file', file)
+            custom_request(
+                self.FILE_URL, data=body, headers={**self.HEADERS, 'Content-Type': body.content_type}
+            )
+            http_client.record_upload(self.FILE_URL, uploaded=body.file_size)
+
+    @staticmethod
+    def resolve_telegram_file_hash(file, telegram_file_hash=None):
+        """
+        The telegram hash to send instead of the file content: the given one, the one stored on the file or
+        the one of another file with the same digest.
+        """
+        if telegram_file_hash or not file:
+            return telegram_file_hash
+        instance = file.instance
+        return instance.telegram_file_hash or File.objects.telegram_file_hash(instance.digest)
+
+    def create_files(self, files):
+        """
+        Creating `files`, a list of `(file, campaign id, content id, telegram file hash)` tuples.
+        Files already uploaded to telegram are sent with one bulk request, the rest are uploaded concurrently.
+        Returns a `(None, exception)` pair for each file, in the order of `files`.
+        """
+        results = [(None, None)] * len(files)
+        uploads = []
+        hashed = []
+        for index, item in enumerate(files):
+            (hashed if item[3] else uploads).append((index, item))
+
+        if hashed and self.bulk_supported(self.FILE_BULK_URL):
+            logger.debug(f"[creating telegram files]-[count: {len(hashed)}]-[URL: {self.FILE_BULK_URL}]")
+            try:
+                if self.bulk_request(
+                        self.FILE_BULK_URL, [self.build_file_payload(*item) for _, item in hashed]
+                ) is not None:
+                    http_client.record_upload(
+                        self.FILE_BULK_URL, skipped=sum(file_size(item[0]) for _, item in hashed)
+                    )
+                    hashed = []
+            except Exception as e:
+                for index, _ in hashed:
+                    results[index] = (None, e)
+                hashed = []
+
+        uploads.extend(hashed)
+        for (index, _), result in zip(
+                uploads,
+                run_concurrently(
+                    self.create_file, [item for _, item in uploads], settings.CAMPAIGN_CONTENT_UPLOAD_CONCURRENCY
+                )
+        ):
+            results[index] = result
+        return results
+
+    @classmethod
+    def bulk_supported(cls, url):
+        return url not in cls._bulk_unsupported_urls
+
+    def bulk_request(self, url, data):
+        """
+        Posting a list of objects to a bulk endpoint. Returns None, and remembers it for this process,
+        when the remote does not support the endpoint.
+        """
+        try:
+            return custom_request(url, json=data, headers=self.HEADERS)
+        except RequestError as e:
+            if e.status_code not in self.BULK_UNSUPPORTED_STATUS_CODES:
+                raise
+        logger.warning(f"[bulk endpoint not supported]-[URL: {url}]")
+        self._bulk_unsupported_urls.add(url)
+        return None
 
     def enable_campaign(self, campaign_id):
         url = f'{self.CAMPAIGN_URL}{campaign_id}/'
@@ -325,12 +463,7 @@ class TelegramCampaignServices(object):
             logger.error(f"[creating telegram campaign failed]-[campaign id: {campaign.id}]")
             return
 
-        if CampaignReference.objects.filter(
-                campaign=campaign,
-                ref_id__isnull=False,
-                schedule_range__startswith__lte=timezone.now(),
-                schedule_range__endswith__gte=timezone.now(),
-        ).exists():
+        if CampaignReference.objects.live().filter(campaign=campaign).exists():
             return
 
         try:
@@ -348,35 +481,59 @@ class TelegramCampaignServices(object):
                 "approved",
             )
 
-            telegram_campaign = TelegramCampaign.objects.get(campaign=campaign)
-            telegram_file_hash = telegram_campaign.telegram_file_hash
-            screenshot = TelegramCampaign.objects.get(campaign=campaign).screenshot.file
-            TelegramCampaignServices().create_file(
-                file=screenshot, campaign_id=ref_id,
-                telegram_file_hash=telegram_file_hash
-            )
-
-            contents = campaign.contents.all()
-            for content in contents:
-                content_ref_id = TelegramCampaignServices().create_content(content, ref_id)
-                file = get_file(content.data.get('file', None))
-                telegram_file_hash = content.data.get('telegram_file_hash', None)
+            # everything touching the database is resolved here, the uploads below may run on pool threads
+            telegram_campaign = TelegramCampaign.objects.select_related('screenshot').get(campaign=campaign)
+            contents = list(campaign.contents.all())
+
+            content_results = TelegramCampaignServices().create_contents(contents, ref_id)
+            failed_contents = []
+            screenshot = telegram_campaign.screenshot.file
+            files = [(
+                screenshot, ref_id, None,
+                TelegramCampaignServices.resolve_telegram_file_hash(screenshot, telegram_campaign.telegram_file_hash)
+            )]
+            file_contents = [None]
+            file_resolver = FileResolver()
+            file_resolver.prefetch(content.data.get('file', None) for content in contents)
+            for content, (content_ref_id, exc) in zip(contents, content_results):
+                if exc is not None:
+                    logger.error(
+                        f'[creating telegram content failed]-[campaign id: {campaign.id}]'
+                        f'-[content id: {content.id}]-[exc: {exc}]'
+                    )
+                    failed_contents.append(content.id)
+                    continue
+                file = get_file(content.data.get('file', None), file_resolver)
                 if file:
-                    TelegramCampaignServices().create_file(
-                        file,
-                        content_id=content_ref_id,
-                        telegram_file_hash=telegram_file_hash
+                    telegram_file_hash = TelegramCampaignServices.resolve_telegram_file_hash(
+                        file, content.data.get('telegram_file_hash', None)
                     )
+                    files.append((file, None, content_ref_id, telegram_file_hash))
+                    file_contents.append(content)
                 campaign_ref.contents.append({'content': content.pk, 'ref_id': content_ref_id, 'views': 0})
 
+            file_results = TelegramCampaignServices().create_files(files)
+            (_, screenshot_exc), file_results = file_results[0], file_results[1:]
+            if screenshot_exc is not None:
+                raise screenshot_exc
+            for content, (_, exc) in zip(file_contents[1:], file_results):
+                if exc is not None:
+                    logger.error(
+                        f'[creating telegram file failed]-[campaign id: {campaign.id}]'
+                        f'-[content id: {content.id}]-[exc: {exc}]'
+                    )
+                    failed_contents.append(content.id)
+
+            if failed_contents:
+                raise Exception(f'uploading contents {failed_contents} failed')
+
             if TelegramCampaignServices().enable_campaign(ref_id):
                 campaign_ref.ref_id = ref_id
                 campaign_ref.save()
                 return campaign_ref
         except Exception as e:
             logger.error(f'[creating telegram campaign failed]-[campaign id: {campaign.id}]-[exc: {e}]')
-            campaign.error_count += 1
-            campaign.save()
+            CampaignService.increase_error_count(campaign)
             raise e
 
     @staticmethod
@@ -402,6 +559,25 @@ class TelegramCampaignServices(object):
 
 
 class CampaignService(object):
+    @staticmethod
+    def increase_error_count(campaign):
+        Campaign.objects.filter(pk=campaign.pk).update(error_count=F('error_count') + 1)
+        campaign.refresh_from_db(fields=['error_count'])
+
+    @staticmethod
+    def provision_campaigns(create_campaign_func, jobs, medium):
+        """
+            Creating the campaigns of `jobs`, a list of `(campaign, start_datetime, end_datetime)`,
+            on at most `CAMPAIGN_PROVISIONING_CONCURRENCY` threads.
+        """
+        results = run_concurrently(create_campaign_func, jobs, settings.CAMPAIGN_PROVISIONING_CONCURRENCY)
+        for (campaign, _, _), (_, exc) in zip(jobs, results):
+            if exc is not None:
+                logger.error(
+                    f'[creating campaign by medium failed]-[medium: {medium}]-[campaign id: {campaign.id}]-[exc: {exc}]'
+                )
+        return results
+
     @staticmethod
     def create_campaign_by_medium(campaigns, medium):
         logger.debug(f'[creating campaing by medium]-[medium: {medium}]')
@@ -414,29 +590,41 @@ class CampaignService(object):
             logger.error(f'[creating campaign by medium failed]-[medium: {medium}]-[exc: {e}]')
             return
 
-        # create scheduled campaigns
-        schedules = CampaignSchedule.objects.filter(
-            campaign_id__in=campaigns.values_list('id', flat=True),
-            week_day=timezone.now().date().weekday(),
-            start_time__lte=timezone.now().time(),
-            end_time__gt=timezone.now().time(),
-        )
-
-        for schedule in schedules:
-            schedule_lower_range = timezone.now().replace(
-                hour=schedule.start_time.hour,
-                minute=schedule.start_time.minute,
+        # create scheduled campaigns, only the schedule windows due since the last tick
+        timeline = get_timeline(medium, {
+            'instagram': (Medium.INSTAGRAM_POST, Medium.INSTAGRAM_STORY),
+            'telegram': (Medium.TELEGRAM,),
+        }[medium])
+        windows = timeline.due()
+        due_campaigns = campaigns.in_bulk([window.campaign_id for window in windows])
+
+        jobs = {}
+        for window in windows:
+            campaign = due_campaigns.get(window.campaign_id)
+            if campaign is None:
+                continue
+            jobs.setdefault(window.campaign_id, (
+                campaign,
+                window.start.replace(second=0, microsecond=0),
+                window.end.replace(second=0, microsecond=0),
+            ))
+        # at most `ADBOT_MAX_CONCURRENT_CAMPAIGN` live campaigns, the windows left out are due again on the next tick
+        free_slots = settings.ADBOT_MAX_CONCURRENT_CAMPAIGN - CampaignReference.objects.live().count() if jobs else 0
+        jobs = list(jobs.values())[:max(free_slots, 0)]
+        if len(jobs) < len(due_campaigns):
+            logger.info(
+                f'[scheduled campaigns capped]-[medium: {medium}]-[due: {len(due_campaigns)}]-[created: {len(jobs)}]'
             )
+        CampaignService.provision_campaigns(create_campaign_func, jobs, medium)
 
-            schedule_upper_range = timezone.now().replace(
-                hour=schedule.end_time.hour,
-                minute=schedule.end_time.minute,
-            )
-            try:
-                create_campaign_func(schedule.campaign, schedule_lower_range, schedule_upper_range)
-            except Exception as e:
-                logger.error(f'[creating campaign by medium failed]-[medium: {medium}]-[exc: {e}]')
-                continue
+        # a window is due again on the next tick until its campaign has a live reference, the create function
+        # returns without one when the campaign can not be created yet too
+        live_campaign_ids = set(CampaignReference.objects.live().filter(
+            campaign_id__in=[window.campaign_id for window in windows]
+        ).values_list('campaign_id', flat=True)) if windows else set()
+        for window in windows:
+            if window.campaign_id not in live_campaign_ids:
+                timeline.retry(window)
 
         # create non scheduled campaigns if possible
         concurrent_campaign_count = CampaignReference.objects.live().count()
@@ -446,6 +634,8 @@ class CampaignService(object):
             ).annotate(
                 num_ref=Count('campaignreference')
             ).order_by('num_ref')
+
+            jobs = []
             for campaign in campaigns[:settings.ADBOT_MAX_CONCURRENT_CAMPAIGN - concurrent_campaign_count]:
                 start_datetime = timezone.now()
 
@@ -456,8 +646,41 @@ class CampaignService(object):
                     )
                 else:
                     end_datetime = start_datetime + timedelta(hours=18)
-                try:
-                    create_campaign_func(campaign, start_datetime, end_datetime)
-                except Exception as e:
-                    logger.error(f'[creating campaign by medium failed]-[medium: {medium}]-[exc: {e}]')
-                continue
+                jobs.append((campaign, start_datetime, end_datetime))
+            CampaignService.provision_campaigns(create_campaign_func, jobs, medium)
+
+    @staticmethod
+    def disable_finished_campaigns(chunk_size=None):
+        """
+            Disabling expired and over budget campaigns and creating their deduct transactions, chunk by chunk.
+            Campaigns locked by another process are skipped and will be handled on the next run.
+        """
+        chunk_size = chunk_size or settings.DISABLE_FINISHED_CAMPAIGNS_CHUNK_SIZE
+        campaign_ids = list(Campaign.objects.finished().values_list('id', flat=True))
+        logger.debug(f'[disabling finished campaigns]-[count: {len(campaign_ids)}]')
+
+        disabled_count = 0
+        for index in range(0, len(campaign_ids), chunk_size):
+            with transaction.atomic():
+                campaigns = list(
+                    Campaign.objects.finished().select_for_update(skip_locked=True).filter(
+                        id__in=campaign_ids[index:index + chunk_size]
+                    ).only('id', 'owner_id')
+                )
+                if not campaigns:
+                    continue
+
+                Transaction.objects.bulk_create([
+                    Transaction(
+                        user_id=campaign.owner_id,
+                        value=campaign.spent,
+                        campaign_id=campaign.id,
+                        transaction_type=Transaction.TYPE_DEDUCT,
+                    ) for campaign in campaigns
+                ])
+                disabled_count += Campaign.objects.filter(
+                    id__in=[campaign.id for campaign in campaigns]
+                ).update(is_enable=False)
+
+        logger.info(f'[finished campaigns disabled]-[count: {disabled_count}]')
+        return disabled_count
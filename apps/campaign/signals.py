@@ -1,10 +1,13 @@
 import logging
 
-from django.db.models.signals import post_save, pre_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
-from apps.campaign.models import Campaign
+from apps.campaign.models import Campaign, CampaignContent, CampaignReference, CampaignSchedule, Province
+from apps.campaign.scheduler import bump_schedule_version
 from apps.core.consts import CostModel
+from apps.core.utils.cache import bump_version_on_commit
 from apps.medium.models import Publisher
 from apps.payments.models import Transaction
 
@@ -44,3 +47,43 @@ def create_transaction(sender, instance, created, **kwargs):
     # Updating Final Publisher field
     if instance._b_status == Campaign.STATUS_DRAFT and instance.status == Campaign.STATUS_WAITING:
         instance.update_final_publishers()
+
+
+@receiver(post_save, sender=Campaign)
+@receiver(post_delete, sender=Campaign)
+@receiver(post_save, sender=CampaignSchedule)
+@receiver(post_delete, sender=CampaignSchedule)
+def invalidate_schedule_timeline(sender, **kwargs):
+    # bumped again after commit, so other processes do not rebuild from uncommitted schedules only
+    bump_schedule_version()
+    transaction.on_commit(bump_schedule_version)
+
+
+@receiver(post_save, sender=Campaign)
+@receiver(post_delete, sender=Campaign)
+@receiver(post_save, sender=CampaignContent)
+@receiver(post_delete, sender=CampaignContent)
+@receiver(post_save, sender=CampaignReference)
+@receiver(post_delete, sender=CampaignReference)
+def invalidate_report_responses(sender, instance, **kwargs):
+    # report ingestion saves every campaign reference it updates, with its campaign already selected
+    if sender is Campaign:
+        owner_id = instance.owner_id
+    elif sender.campaign.is_cached(instance):
+        owner_id = instance.campaign.owner_id
+    else:
+        owner_id = Campaign.objects.filter(pk=instance.campaign_id).values_list('owner_id', flat=True).first()
+    bump_version_on_commit('reports', owner_id)
+
+
+@receiver(post_save, sender=Publisher)
+@receiver(post_delete, sender=Publisher)
+def invalidate_publisher_report_responses(sender, **kwargs):
+    # reports of every owner render the names and tags of their publishers
+    bump_version_on_commit('reports')
+
+
+@receiver(post_save, sender=Province)
+@receiver(post_delete, sender=Province)
+def invalidate_province_responses(sender, **kwargs):
+    bump_version_on_commit('provinces')
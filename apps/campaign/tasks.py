@@ -1,89 +1,67 @@
 import logging
 
-from django.utils import timezone
-from django.db import transaction
 from django.conf import settings
 
 from celery.schedules import crontab
 from celery.task import periodic_task
 from celery import shared_task
 
-from apps.campaign.models import Campaign, CampaignReference, CampaignContent
+from apps.campaign.models import Campaign, CampaignReference
 from apps.medium.consts import Medium
-from apps.payments.models import Transaction
-from services.utils import stop_duplicate_task
+from services.utils import distributed_lock, hold_locks
 
-from .services import CampaignService, TelegramCampaignServices
-from .utils import update_campaign_reference_adtel
+from .services import CampaignService
+from .utils import update_campaign_references_adtel
 
 logger = logging.getLogger(__name__)
 
 
 @periodic_task(run_every=crontab(minute="*"))
+@distributed_lock()
 def disable_finished_campaigns():
-    campaigns = Campaign.objects.select_for_update(skip_locked=True).filter(
-        is_enable=True,
-        status=Campaign.STATUS_APPROVED,
-        start_date__lte=timezone.now().date(),
-    )
-
     # disable expired and over budget campaigns
-    with transaction.atomic():
-        for campaign in campaigns:
-            if campaign.is_finished():
-                # create a deduct transaction
-                Transaction.objects.create(
-                    user=campaign.owner,
-                    value=campaign.total_cost,
-                    campaign=campaign,
-                    transaction_type=Transaction.TYPE_DEDUCT,
-                )
-                campaign.is_enable = False
-                campaign.save()
+    CampaignService.disable_finished_campaigns()
 
 
 @periodic_task(run_every=crontab(minute="*/1"))
+@distributed_lock()
 def create_telegram_campaign_task():
     # filter approved and enable telegram campaigns
     campaigns = Campaign.objects.live().filter(medium=Medium.TELEGRAM, error_count__lt=5)
     CampaignService.create_campaign_by_medium(campaigns, 'telegram')
 
 
-# @stop_duplicate_task
-# def create_telegram_campaign():
-#     # filter approved and enable telegram campaigns
-#     campaigns = Campaign.objects.live().filter(medium=Medium.TELEGRAM, error_count__lt=5)
-#     CampaignService.create_campaign_by_medium(campaigns, 'telegram')
-
-
 # update content view in Campaign Reference model and add telegram file hashes
 @periodic_task(run_every=crontab(**settings.UPDATE_TELEGRAM_INFO_TASK_CRONTAB))
+@distributed_lock()
 def update_telegram_info_task():
     # filter appropriate campaigns to save gotten views
-    campaign_refs = CampaignReference.objects.monitor_report()
-
-    for campaign_ref in campaign_refs:
-        update_campaign_reference_adtel(campaign_ref)
-
-        camp = campaign_ref.campaign
-        # getting file hashes for the first campaign reference is enough
-        if camp.campaignreference_set.count() == 1:
-            for content in campaign_ref.contents:
-                content_id = content["content"]
-                for item in TelegramCampaignServices().get_contents(campaign_ref.ref_id):
-                    if item["id"] == content["ref_id"]:
-                        c = CampaignContent.objects.get(pk=content_id)
-                        for file in item["files"]:
-                            c.data["telegram_file_hash"] = file["telegram_file_hash"]
-                            c.save()
-                            # currently one file can be saved
-                            break
+    campaign_refs_id = list(CampaignReference.objects.monitor_report().values_list('id', flat=True))
+
+    chunk_size = settings.REPORT_INGESTION_CHUNK_SIZE
+    for index in range(0, len(campaign_refs_id), chunk_size):
+        update_telegram_info_chunk_task.delay(*campaign_refs_id[index:index + chunk_size])
+    logger.info(f'[updating telegram info]-[campaign references: {len(campaign_refs_id)}]-[chunk size: {chunk_size}]')
+
+
+@shared_task
+def update_telegram_info_chunk_task(*campaign_references_id):
+    # a reference is updated by one chunk at a time, the ones a chunk of an earlier run still holds are skipped
+    lock_names = {f'update_telegram_info:{ref_id}': ref_id for ref_id in campaign_references_id}
+    with hold_locks(lock_names) as locked:
+        locked_ids = [lock_names[name] for name in locked]
+        if len(locked_ids) < len(campaign_references_id):
+            logger.warning(
+                f'[campaign references skipped, lock is held]'
+                f'-[skipped: {len(campaign_references_id) - len(locked_ids)}]'
+            )
+        updated = update_campaign_references_adtel(CampaignReference.objects.filter(id__in=locked_ids))
+    logger.info(f'[telegram info updated]-[campaign references: {len(locked_ids)}]-[updated: {updated}]')
 
 
 @shared_task
 def update_telegram_reports_from_admin(*campaign_references_id):
-    for campaign_refs in CampaignReference.objects.filter(id__in=campaign_references_id):
-        update_campaign_reference_adtel(campaign_refs)
+    update_campaign_references_adtel(CampaignReference.objects.filter(id__in=campaign_references_id))
 
 
 # TODO create_instagram_campaign_task is disable for now
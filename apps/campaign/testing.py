@@ -0,0 +1,55 @@
+import random
+
+
+def legacy_sort_hours(start_date, end_date):
+    diff = end_date - start_date
+    days, seconds = diff.days, diff.seconds
+    diff_hours = (days * 24 + seconds // 3600) + 1
+    hour = start_date.hour
+
+    sorted_hours = []
+    for i in range(diff_hours):
+        sorted_hours.append(str(hour))
+        hour += 1
+        if hour >= 24:
+            hour = 0
+    return sorted_hours
+
+
+def legacy_sort_reports_by_hour(data, start_date, end_date):
+    if len(data) <= 1:
+        return [dict(y=data[key], name=key) for key in data.keys()]
+    result = []
+    keys = data.keys()
+
+    for key in legacy_sort_hours(start_date, end_date):
+        if key in keys:
+            result.append(dict(y=data[key], name=key))
+    return result
+
+
+def legacy_hourly_series(hourly, start_date, end_date):
+    """The hourly chart series as built by `update_campaign_reference_adtel` before `apps.campaign.timeseries`."""
+    cumulative = legacy_sort_reports_by_hour(hourly, start_date, end_date)
+    views = {}
+    keys = legacy_sort_hours(start_date, end_date)
+    for index, key in enumerate(keys, 0):
+        try:
+            if index + 1 == len(hourly):
+                views[key] = abs(hourly[key] - hourly[keys[index - 1]])
+            else:
+                views[keys[index + 1]] = abs(hourly[key] - hourly[keys[index + 1]])
+                if index == 0:
+                    views[key] = hourly[key]
+        except:  # noqa: E722
+            continue
+    return cumulative, legacy_sort_reports_by_hour(views, start_date, end_date)
+
+
+def cumulative_report(start_date, hours, rand=random):
+    """Random cumulative hourly counters of the first `hours` hours from `start_date`, drawn from `rand`."""
+    hourly, views = {}, 0
+    for index in range(hours):
+        views += rand.randint(0, 1000)
+        hourly[str((start_date.hour + index) % 24)] = views
+    return hourly
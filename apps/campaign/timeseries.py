@@ -0,0 +1,38 @@
+from datetime import timedelta
+from itertools import accumulate
+
+HOURS_IN_DAY = 24
+
+
+def hour_labels(start_date, end_date):
+    """
+    Hour of day labels of the reports of a campaign reference running from `start_date` to `end_date`, in order.
+    The hour of `end_date` is included and an hour is labeled once when the range is longer than a day, as the
+    reports of ad-tel are keyed by the hour of day.
+    """
+    first_hour = start_date.replace(minute=0, second=0, microsecond=0)
+    count = (end_date - first_hour) // timedelta(hours=1) + 1
+    return [str((first_hour.hour + index) % HOURS_IN_DAY) for index in range(max(0, min(count, HOURS_IN_DAY)))]
+
+
+def ordered_series(hourly, labels):
+    """`{label: value}` as the `[{'y': value, 'name': label}, ...]` series of the charts, ordered by `labels`."""
+    return [dict(y=hourly[label], name=label) for label in labels if label in hourly]
+
+
+def hourly_deltas(cumulative, labels):
+    """
+    Per hour views of the `{label: cumulative views}` counters, as a series ordered by `labels`.
+    The first hour has its cumulative value and every other reported hour its increase over the highest earlier
+    counter, so a missing hour does not drop the next one and a counter going down counts as no views.
+    """
+    reported = [label for label in labels if label in cumulative]
+    values = [cumulative[label] for label in reported]
+    previous = [0] + list(accumulate(values, max))[:-1]
+    return [dict(y=max(0, value - last), name=label) for label, value, last in zip(reported, values, previous)]
+
+
+def hourly_series(cumulative, start_date, end_date):
+    """The `(cumulative, views)` hourly chart series of a campaign reference's cumulative report."""
+    labels = hour_labels(start_date, end_date)
+    return ordered_series(cumulative, labels), hourly_deltas(cumulative, labels)
@@ -1,86 +1,188 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
 from django.utils import timezone
 
+from apps.core.models import File
+from services.utils import run_concurrently
 
-def sort_hours(start_date, end_date):
-    diff = end_date - start_date
-    days, seconds = diff.days, diff.seconds
-    diff_hours = (days * 24 + seconds // 3600) + 1
-    hour = start_date.hour
+from .timeseries import hour_labels, hourly_series
 
-    sorted_hours = []
-    for i in range(diff_hours):
-        sorted_hours.append(str(hour))
-        hour += 1
-        if hour >= 24:
-            hour = 0
-    return sorted_hours
+logger = logging.getLogger(__name__)
 
 
-def sort_reports_by_hour(data, start_date, end_date):
-    """Sort reports by campaign reference start date"""
-    if len(data) <= 1:
-        return [dict(y=data[key], name=key) for key in data.keys()]
-    result = []
-    keys = data.keys()
+def hour_buckets(start_date, end_date):
+    """Mapping the hour labels of a campaign reference's reports to the start datetime of their hour"""
+    first_bucket = start_date.replace(minute=0, second=0, microsecond=0)
+    buckets = {}
+    for index, hour in enumerate(hour_labels(start_date, end_date)):
+        buckets.setdefault(hour, first_bucket + timedelta(hours=index))
+    return buckets
 
-    # y => value, label => hour
-    for key in sort_hours(start_date, end_date):
-        if key in keys:
-            result.append(dict(y=data[key], name=key))
-    return result
 
+class TelegramFileHashes(object):
+    """
+    Telegram file hashes learned from ad-tel campaigns, written back with one bulk update per model.
+    """
 
-def update_campaign_reference_adtel(campaign_ref):
+    def __init__(self):
+        self.telegram_campaigns = {}
+        self.contents = {}
+        self.files = {}
+
+    def add_campaign(self, telegram_campaign, remote_campaign):
+        file = remote_campaign.get('file') or {}
+        file_hash = file.get('telegram_file_hash')
+        if file_hash:
+            telegram_campaign.telegram_file_hash = file_hash
+            self.telegram_campaigns[telegram_campaign.pk] = telegram_campaign
+            # kept on the file too, so other campaigns using the same screenshot do not upload it again
+            self.files[telegram_campaign.screenshot_id] = file_hash
+
+    def add_contents(self, campaign_ref, remote_campaign, campaign_contents):
+        remote_contents = {item['id']: item for item in remote_campaign.get('contents') or []}
+        for content in campaign_ref.contents:
+            item = remote_contents.get(content['ref_id'])
+            campaign_content = campaign_contents.get(content['content'])
+            if item is None or campaign_content is None or not item['files']:
+                continue
+            # currently one file can be saved
+            file_hash = item['files'][0]['telegram_file_hash']
+            campaign_content.data['telegram_file_hash'] = file_hash
+            self.contents[campaign_content.pk] = campaign_content
+            if campaign_content.data.get('file'):
+                self.files[campaign_content.data['file']] = file_hash
+
+    def save(self):
+        from apps.campaign.models import CampaignContent, TelegramCampaign
+
+        TelegramCampaign.objects.bulk_update(self.telegram_campaigns.values(), ['telegram_file_hash'])
+        CampaignContent.objects.bulk_update(self.contents.values(), ['data'])
+        File.objects.bulk_update(
+            [File(pk=pk, telegram_file_hash=file_hash) for pk, file_hash in self.files.items()],
+            ['telegram_file_hash']
+        )
+
+
+def update_campaign_reference_adtel(campaign_ref, remote_campaign=None, reports=None, file_hashes=None,
+                                    with_contents=False):
+    from apps.campaign.models import CampaignContent, CampaignReference
     from apps.campaign.services import TelegramCampaignServices
 
     """
         Updating `views`, `detail` and hourly report of the campaign reference object from ad-tel.
+        `remote_campaign` and `reports` are fetched when not given, telegram file hashes are collected in
+        `file_hashes` when given and saved right away otherwise.
     """
+    if remote_campaign is None:
+        remote_campaign = TelegramCampaignServices().get_campaign(campaign_ref.ref_id)
+    if reports is None:
+        reports = TelegramCampaignServices().campaign_report(campaign_ref.ref_id)
+    campaign_contents = CampaignContent.objects.in_bulk([content["content"] for content in campaign_ref.contents])
+
+    collected_hashes = file_hashes if file_hashes is not None else TelegramFileHashes()
     # store telegram file hash of screenshot in TelegramCampaign model
-    file_hash = TelegramCampaignServices().campaign_telegram_file_hash(campaign_ref.ref_id)
-    if file_hash:
-        campaign_ref.campaign.telegramcampaign.telegram_file_hash = file_hash
+    telegram_campaign = getattr(campaign_ref.campaign, 'telegramcampaign', None)
+    if telegram_campaign is not None:
+        collected_hashes.add_campaign(telegram_campaign, remote_campaign)
+    if with_contents:
+        collected_hashes.add_contents(campaign_ref, remote_campaign, campaign_contents)
 
     # get each content views and store in content json field
-    reports = TelegramCampaignServices().campaign_report(campaign_ref.ref_id)
+    with transaction.atomic():
+        # views already stored in the spend ledger, read from the locked row to avoid counting them twice
+        stored_contents = CampaignReference.objects.select_for_update().values_list(
+            'contents', flat=True
+        ).get(pk=campaign_ref.pk)
+        previous_contents = {content["content"]: content for content in stored_contents}
+
+        update_campaign_reference_contents(campaign_ref, reports, campaign_contents, previous_contents)
+        campaign_ref.save()
+
+    if file_hashes is None:
+        collected_hashes.save()
+
+
+def update_campaign_references_adtel(campaign_refs):
+    """
+        Updating a batch of campaign references from ad-tel, the campaign and report of each reference are
+        fetched concurrently and telegram file hashes of the batch are written back in bulk.
+    """
+    from apps.campaign.services import TelegramCampaignServices
+
+    campaign_refs = list(
+        campaign_refs.select_related('campaign__telegramcampaign').annotate(
+            reference_count=Count('campaign__campaignreference')
+        )
+    )
+
+    def fetch(campaign_ref):
+        service = TelegramCampaignServices()
+        return service.get_campaign(campaign_ref.ref_id), service.campaign_report(campaign_ref.ref_id)
+
+    responses = run_concurrently(
+        fetch, [(campaign_ref,) for campaign_ref in campaign_refs], settings.REPORT_INGESTION_CONCURRENCY
+    )
+
+    file_hashes = TelegramFileHashes()
+    updated = 0
+    for campaign_ref, (response, exc) in zip(campaign_refs, responses):
+        try:
+            if exc is not None:
+                raise exc
+            remote_campaign, reports = response
+            update_campaign_reference_adtel(
+                campaign_ref, remote_campaign, reports, file_hashes,
+                # getting file hashes for the first campaign reference is enough
+                with_contents=campaign_ref.reference_count == 1,
+            )
+            updated += 1
+        except Exception as e:
+            logger.error(
+                f'[updating campaign reference failed]-[campaign reference id: {campaign_ref.id}]-[exc: {e}]'
+            )
+    file_hashes.save()
+    return updated
+
+
+def update_campaign_reference_contents(campaign_ref, reports, campaign_contents, previous_contents):
+    from apps.campaign.models import CampaignReferenceContent, CampaignSpend
+
     for content in campaign_ref.contents:
         for report in reports:
             if content["ref_id"] == report["content"]:
                 start_date = campaign_ref.schedule_range.lower
                 end_date = campaign_ref.schedule_range.upper
 
+                campaign_content = campaign_contents.get(content["content"])
+                previous_content = previous_contents.get(content["content"], {})
+                if campaign_content is not None:
+                    CampaignSpend.objects.record(
+                        campaign_ref,
+                        campaign_content,
+                        views=report["views"],
+                        previous_views=previous_content.get("views", 0),
+                    )
                 content["views"] = report["views"]
                 content["detail"] = report["detail"]
 
                 if 'hourly' in report.keys():
-                    # hourly cumulative
-                    content['graph_hourly_cumulative'] = sort_reports_by_hour(report['hourly'], start_date, end_date)
-
-                    content['graph_hourly_view'] = {}
-                    # creating the view by hour
-                    keys = sort_hours(start_date, end_date)
-                    for index, key in enumerate(keys, 0):
-                        try:
-                            if index + 1 == len(report['hourly']):
-                                # calculate the last one
-                                content['graph_hourly_view'][key] = abs(report['hourly'][key] - report['hourly'][keys[index - 1]])
-                            else:
-                                content['graph_hourly_view'][keys[index + 1]] = abs(report['hourly'][key] - report['hourly'][keys[index + 1]])
-                                if index == 0:
-                                    # calculate the first one
-                                    content['graph_hourly_view'][key] = report['hourly'][key]
-                        except:
-                            continue
-                    content['graph_hourly_view'] = sort_reports_by_hour(
-                        content['graph_hourly_view'], start_date, end_date
+                    # hourly cumulative and views by hour
+                    content['graph_hourly_cumulative'], content['graph_hourly_view'] = hourly_series(
+                        report['hourly'], start_date, end_date
                     )
+
                     # end of getting report for this campaign
                     # TODO telegram issue - If telegram can't read new reports on end time of campaign reference
                     end_time_campaign = campaign_ref.schedule_range.upper
                     if timezone.now() > end_time_campaign and end_time_campaign.hour in report['hourly'].keys():
                         campaign_ref.report_time = timezone.now()
 
-    campaign_ref.save()
+                if campaign_content is not None:
+                    CampaignReferenceContent.objects.store(campaign_ref, campaign_content, content)
 
 
 def get_hourly_report_dashboard(temp_reports, sort_key):
@@ -1,8 +1,10 @@
 from rest_framework.routers import DefaultRouter
 
-from .views import FileViewSet
+from .views import CacheStatsViewSet, FileViewSet, HttpStatsViewSet
 
 router = DefaultRouter()
 router.register('files', FileViewSet)
+router.register('http-stats', HttpStatsViewSet, basename='http-stats')
+router.register('cache-stats', CacheStatsViewSet, basename='cache-stats')
 
 urlpatterns = router.urls
@@ -1,9 +1,12 @@
 from rest_framework import mixins, viewsets
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.response import Response
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
 from apps.core.api.serializers import FileSerializer
 from apps.core.models import File
+from apps.core.utils.cache import cache_metrics
+from services.http import http_client
 
 
 class FileViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
@@ -11,3 +14,19 @@ class FileViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
     permission_classes = (IsAuthenticated,)
     serializer_class = FileSerializer
     queryset = File.objects.all()
+
+
+class HttpStatsViewSet(viewsets.ViewSet):
+    authentication_classes = (JWTAuthentication,)
+    permission_classes = (IsAdminUser,)
+
+    def list(self, request):
+        return Response(http_client.stats())
+
+
+class CacheStatsViewSet(viewsets.ViewSet):
+    authentication_classes = (JWTAuthentication,)
+    permission_classes = (IsAdminUser,)
+
+    def list(self, request):
+        return Response(cache_metrics.stats())
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from apps.core.models import File
+
+
+class Command(BaseCommand):
+    help = 'Compute the content digest of the uploaded files that do not have one yet.'
+
+    def handle(self, *args, **options):
+        stored_count = missing_count = 0
+        for file in File.objects.filter(digest='').exclude(file='').iterator():
+            try:
+                file.digest = file.compute_digest()
+            except (OSError, ValueError):
+                missing_count += 1
+                continue
+            file.save(update_fields=['digest'])
+            stored_count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{stored_count} file digests stored, {missing_count} files missing.'))
@@ -1,3 +1,5 @@
+import hashlib
+
 from django.db import models
 
 
@@ -8,8 +10,38 @@ class BaseModel(models.Model):
         abstract = True
 
 
+class FileManager(models.Manager):
+    def telegram_file_hash(self, digest):
+        """Telegram file hash of an already uploaded file with the same content, if any."""
+        if not digest:
+            return None
+        return self.filter(digest=digest).exclude(telegram_file_hash='').values_list(
+            'telegram_file_hash', flat=True
+        ).first()
+
+
 class File(models.Model):
     file = models.FileField()
+    digest = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
+    telegram_file_hash = models.CharField(max_length=512, blank=True)
+
+    objects = FileManager()
 
     def __str__(self):
         return self.file.name
+
+    def save(self, *args, **kwargs):
+        if self.file and not self.digest:
+            try:
+                self.digest = self.compute_digest()
+            except OSError:
+                # missing from the storage, left for `backfill_file_digests`
+                pass
+        super().save(*args, **kwargs)
+
+    def compute_digest(self):
+        # sha256 of the file content, read in chunks so large videos are not loaded in memory
+        sha256 = hashlib.sha256()
+        for chunk in self.file.chunks():
+            sha256.update(chunk)
+        return sha256.hexdigest()
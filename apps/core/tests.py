@@ -1,3 +1,197 @@
-from django.test import TestCase
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connections
+from django.test import TestCase, override_settings
+
+from apps.core.models import File
+from services.adbot_stub import AdBotStubServer
+from services.http import HttpClient, MultipartFileBody, http_client
+from apps.core.utils.cache import cache_metrics, get_or_compute
+from services.utils import CacheLease, distributed_lock, hold_locks, skipped_runs
+
+
+class FileDigestTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_digest(self):
+        content = b'video' * 100000
+        file = File(telegram_file_hash='hash')
+        file.file.save('video.mp4', ContentFile(content))
+
+        self.assertEqual(file.digest, hashlib.sha256(content).hexdigest())
+        other = File.objects.create(file=file.file.name)
+        self.assertEqual(File.objects.telegram_file_hash(other.digest), 'hash')
+
+        File.objects.filter(pk=other.pk).update(digest='')
+        call_command('backfill_file_digests', stdout=StringIO())
+        other.refresh_from_db()
+        self.assertEqual(other.digest, file.digest)
+
+    def test_multipart_file_body(self):
+        file = File()
+        file.file.save('video.mp4', ContentFile(b'video' * 100000))
+        body = MultipartFileBody({'name': 'video.mp4', 'telegram_file_hash': None}, 'file', file.file, chunk_size=4096)
+
+        with AdBotStubServer() as server:
+            response = http_client.request(
+                'post', f'{server.url}/api/v1/files/', data=body, headers={'Content-Type': body.content_type}
+            )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(server.requests, [('POST', '/api/v1/files/', len(body))])
+        self.assertEqual(len(b''.join(body)), len(body))
+        self.assertIn(b'name="file"; filename="video.mp4"', body.head)
+
+    def test_http_client_stats(self):
+        client = HttpClient(max_retries=0)
+        with AdBotStubServer() as server:
+            client.request('get', f'{server.url}/api/v1/unknown/')
+            with mock.patch('requests.Session.request', return_value=mock.Mock(status_code=503)):
+                client.request('get', f'{server.url}/api/v1/channels/')
+            stats = client.stats()[server.url.split('//')[1]]
+
+        # a client error is answered by the server, a server error is a failed request
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['errors'], 1)
+
+
+class DistributedLockTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def run_in_thread(self, func, *args):
+        results = []
+
+        def run():
+            try:
+                results.append(func(*args))
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread, results
+
+    @mock.patch('services.utils.cache_is_shared', return_value=True)
+    def test_skip_if_held(self, cache_is_shared):
+        started, finish = threading.Event(), threading.Event()
+
+        @distributed_lock(name='test-task', ttl=1)
+        def task(value):
+            started.set()
+            finish.wait(5)
+            return value
+
+        thread, results = self.run_in_thread(task, 'first')
+        started.wait(5)
+
+        # the lease outlives its ttl while the first run is renewing it
+        time.sleep(1.5)
+        self.assertIsNone(task('second'))
+        self.assertIsNone(task('third'))
+        self.assertEqual(skipped_runs('test-task'), 2)
+
+        finish.set()
+        thread.join()
+        self.assertEqual(results, ['first'])
+        self.assertEqual(task.__name__, 'task')
+        self.assertEqual(task('fourth'), 'fourth')
+
+    def test_release_by_owner_only(self):
+        lease = CacheLease('test-lease', 60)
+        self.assertTrue(lease.acquire())
+        other = CacheLease('test-lease', 60)
+        self.assertFalse(other.acquire())
+        other.release()
+        self.assertFalse(CacheLease('test-lease', 60).acquire())
+        lease.release()
+        self.assertTrue(other.acquire())
+
+        # a lease that may have expired is not deleted, it could be another worker's by now
+        with mock.patch('services.utils.time.monotonic', return_value=time.monotonic() + 50):
+            other.release()
+        self.assertEqual(cache.get(other.key), other.token)
+
+    @mock.patch('services.utils.cache_is_shared', return_value=True)
+    def test_hold_locks(self, cache_is_shared):
+        with hold_locks(['first']):
+            with hold_locks(['first', 'second', 'third']) as locked:
+                self.assertEqual(locked, ['second', 'third'])
+        with hold_locks(['first', 'second']) as locked:
+            self.assertEqual(locked, ['first', 'second'])
+
+    def test_advisory_lock_without_shared_cache(self):
+        started, finish = threading.Event(), threading.Event()
+
+        @distributed_lock(name='test-advisory-task')
+        def task(value):
+            started.set()
+            finish.wait(5)
+            return value
+
+        thread, results = self.run_in_thread(task, 'first')
+        started.wait(5)
+        self.assertIsNone(task('second'))
+
+        finish.set()
+        thread.join()
+        self.assertEqual(results, ['first'])
+        self.assertEqual(task('third'), 'third')
+
+
+class GetOrComputeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        cache_metrics.reset()
+
+    def test_stampede(self):
+        computed = []
+
+        def compute():
+            computed.append(1)
+            time.sleep(0.3)
+            return 'value'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(get_or_compute('test', 'test-key', compute, 60)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # one thread computes while the others wait for its value
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(len(computed), 1)
+        self.assertEqual(get_or_compute('test', 'test-key', compute, 60), 'value')
+
+        stats = cache_metrics.stats()['test']
+        self.assertEqual((stats['hits'], stats['misses'], stats['computes']), (1, 5, 1))
+
+    def test_early_refresh(self):
+        values = iter(['first', 'second'])
+        self.assertEqual(get_or_compute('test', 'test-key', lambda: next(values), 60), 'first')
+        self.assertEqual(get_or_compute('test', 'test-key', lambda: next(values), 60, beta=0), 'first')
+
+        # a value that took long to compute compared to the time left is refreshed before it expires
+        value, _, expiry = cache.get('test-key')
+        cache.set('test-key', (value, 100, expiry), 60)
+        with mock.patch('apps.core.utils.cache.random.random', return_value=0.5):
+            self.assertEqual(get_or_compute('test', 'test-key', lambda: next(values), 60), 'second')
+        self.assertEqual(cache_metrics.stats()['test']['early_refreshes'], 1)
@@ -0,0 +1,210 @@
+import functools
+import hashlib
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from services.utils import CacheLease
+
+logger = logging.getLogger(__name__)
+
+
+class CacheMetrics(object):
+    """
+    Hit, miss, early refresh and compute time counts of the values of each namespace read by this process
+    through `get_or_compute`.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, namespace, hits=0, misses=0, early_refreshes=0, compute_time=None):
+        with self._lock:
+            stats = self._stats.setdefault(
+                namespace, dict(hits=0, misses=0, early_refreshes=0, computes=0, total_compute_time=0.0)
+            )
+            stats['hits'] += hits
+            stats['misses'] += misses
+            stats['early_refreshes'] += early_refreshes
+            if compute_time is not None:
+                stats['computes'] += 1
+                stats['total_compute_time'] += compute_time
+
+    def stats(self):
+        with self._lock:
+            result = {}
+            for namespace, stats in self._stats.items():
+                reads = stats['hits'] + stats['misses']
+                result[namespace] = dict(
+                    stats,
+                    hit_ratio=stats['hits'] / reads if reads else 0,
+                    avg_compute_time=stats['total_compute_time'] / stats['computes'] if stats['computes'] else 0,
+                )
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+cache_metrics = CacheMetrics()
+
+
+def _compute(namespace, key, compute, timeout):
+    start = time.monotonic()
+    value = compute()
+    delta = time.monotonic() - start
+    cache.set(key, (value, delta, time.time() + timeout), timeout)
+    cache_metrics.record(namespace, compute_time=delta)
+    return value
+
+
+def get_or_compute(namespace, key, compute, timeout, beta=None, lock_timeout=None):
+    """
+    Value of `key` in the cache, computed by `compute()` and cached for `timeout` seconds when missing.
+    One process computes a missing value at a time while the others wait for it up to `lock_timeout` seconds,
+    and a value is refreshed early by one process with a probability growing as its expiry nears and as its
+    compute time grows (XFetch), so hot values do not all expire at once.
+    """
+    beta = settings.CACHE_EARLY_REFRESH_BETA if beta is None else beta
+    lock_timeout = lock_timeout or settings.CACHE_COMPUTE_LOCK_TIMEOUT
+    lease = CacheLease(f'compute:{key}', lock_timeout)
+
+    entry = cache.get(key)
+    if entry is not None:
+        value, delta, expiry = entry
+        if time.time() - delta * beta * math.log(1 - random.random()) < expiry or not lease.acquire():
+            cache_metrics.record(namespace, hits=1)
+            return value
+        cache_metrics.record(namespace, hits=1, early_refreshes=1)
+        try:
+            return _compute(namespace, key, compute, timeout)
+        finally:
+            lease.release()
+
+    cache_metrics.record(namespace, misses=1)
+    deadline = time.monotonic() + lock_timeout
+    while not lease.acquire():
+        # another process is computing the value
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+        if time.monotonic() >= deadline:
+            logger.warning(f'[waiting for cached value timed out]-[namespace: {namespace}]-[key: {key}]')
+            break
+    try:
+        return _compute(namespace, key, compute, timeout)
+    finally:
+        lease.release()
+
+
+# version of the data shared by all users of a namespace
+GLOBAL_SCOPE = 'global'
+# version of the responses of superusers, which see the data of every owner
+ALL_OWNERS_SCOPE = 'owners'
+# responses not depending on the user
+PUBLIC_SCOPE = 'public'
+
+
+def version_key(namespace, scope):
+    return f'response:version:{namespace}:{scope}'
+
+
+def namespace_version(namespace, scope=GLOBAL_SCOPE):
+    key = version_key(namespace, scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace, owner_id=None):
+    """
+    Expiring the cached responses of `namespace`, the responses of `owner_id` and superusers when given
+    and the responses of every user otherwise.
+    """
+    keys = [version_key(namespace, GLOBAL_SCOPE)] if owner_id is None else [
+        version_key(namespace, owner_id), version_key(namespace, ALL_OWNERS_SCOPE)
+    ]
+    cache.set_many({key: uuid.uuid4().hex for key in keys}, None)
+    logger.debug(f'[response cache version bumped]-[namespace: {namespace}]-[owner id: {owner_id}]')
+
+
+def bump_version_on_commit(namespace, owner_id=None):
+    # bumped right away and again after commit, so a response cached from data that is not committed yet expires
+    bump_version(namespace, owner_id)
+    transaction.on_commit(lambda: bump_version(namespace, owner_id))
+
+
+def response_cache_key(namespace, request, per_owner):
+    if not per_owner:
+        scope = PUBLIC_SCOPE
+    elif request.user.is_superuser:
+        scope = ALL_OWNERS_SCOPE
+    else:
+        scope = request.user.id
+    versions = [namespace_version(namespace)]
+    if scope != PUBLIC_SCOPE:
+        versions.append(namespace_version(namespace, scope))
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'response:{namespace}:{scope}:{":".join(versions)}:{path}'
+
+
+class UncachedResponse(Exception):
+    def __init__(self, response):
+        super().__init__(response.status_code)
+        self.response = response
+
+
+def content_etag(data):
+    return f'"{hashlib.md5(JSONRenderer().render(data)).hexdigest()}"'
+
+
+def cache_response(namespace, per_owner=True, timeout=None):
+    """
+    Caching the data of the successful GET responses of a view method, keyed by the request path, the user
+    when `per_owner` is set and the versions of `namespace`, so bumping a version expires them.
+    Responses carry an ETag of their content and a request with a matching `If-None-Match` is answered with 304.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(view, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return func(view, request, *args, **kwargs)
+
+            def compute():
+                computed = func(view, request, *args, **kwargs)
+                if computed.status_code != status.HTTP_200_OK:
+                    raise UncachedResponse(computed)
+                return computed.data, content_etag(computed.data)
+
+            try:
+                data, etag = get_or_compute(
+                    f'response:{namespace}', response_cache_key(namespace, request, per_owner), compute,
+                    timeout or settings.RESPONSE_CACHE_TTL
+                )
+            except UncachedResponse as e:
+                return e.response
+
+            if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = Response(data)
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
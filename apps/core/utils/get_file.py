@@ -1,8 +1,66 @@
 from apps.core.models import File
+from services.utils import file_type
 
 
-def get_file(pk):
+def file_pk(pk):
     try:
-        return File.objects.get(pk=pk).file
-    except:
+        return int(pk)
+    except (TypeError, ValueError):
         return None
+
+
+class FileResolver(object):
+    """
+    Resolving `File` objects by id, the ids not seen yet are fetched with one `in_bulk` query per `prefetch`
+    and the url and type of each file are memoized.
+    """
+
+    def __init__(self):
+        self._files = {}
+        self._urls = {}
+        self._types = {}
+
+    def prefetch(self, pks):
+        pks = {file_pk(pk) for pk in pks} - set(self._files) - {None}
+        if pks:
+            files = File.objects.in_bulk(pks)
+            self._files.update({pk: files.get(pk) for pk in pks})
+
+    def get(self, pk):
+        pk = file_pk(pk)
+        if pk is None:
+            return None
+        if pk not in self._files:
+            self.prefetch([pk])
+        return self._files[pk]
+
+    def url(self, pk, request=None):
+        file = self.get(pk)
+        if file is None:
+            return None
+        if file.pk not in self._urls:
+            url = file.file.url
+            self._urls[file.pk] = request.build_absolute_uri(url) if request is not None else url
+        return self._urls[file.pk]
+
+    def file_type(self, pk):
+        file = self.get(pk)
+        if file is None:
+            return None
+        if file.pk not in self._types:
+            self._types[file.pk] = file_type(file.__str__())
+        return self._types[file.pk]
+
+
+def content_file_pks(data):
+    """Ids of the files of a campaign content's `data`, a single file, an album or an image."""
+    files = (data or {}).get('file')
+    if isinstance(files, list):
+        return files
+    file_id = files or (data or {}).get('imageId')
+    return [file_id] if file_id is not None else []
+
+
+def get_file(pk, resolver=None):
+    file = (resolver or FileResolver()).get(pk)
+    return file.file if file is not None else None
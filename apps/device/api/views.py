@@ -5,6 +5,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
+from apps.core.utils.cache import cache_response
 from apps.device.consts import ServiceProvider
 from .serializers import (
     DeviceSerializer,
@@ -16,28 +17,34 @@ from .serializers import (
 from ..models import Device, Platform, OS, Version
 
 
-class DeviceViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+class DeviceListMixin(mixins.ListModelMixin):
+    @cache_response('devices', per_owner=False)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+
+class DeviceViewSet(DeviceListMixin, viewsets.GenericViewSet):
     authentication_classes = (JWTAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = Device.objects.all()
     serializer_class = DeviceSerializer
 
 
-class PlatformViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+class PlatformViewSet(DeviceListMixin, viewsets.GenericViewSet):
     authentication_classes = (JWTAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = Platform.objects.all()
     serializer_class = PlatformSerializer
 
 
-class OSViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+class OSViewSet(DeviceListMixin, viewsets.GenericViewSet):
     authentication_classes = (JWTAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = OS.objects.all()
     serializer_class = OSSerializer
 
 
-class OSVersionViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+class OSVersionViewSet(DeviceListMixin, viewsets.GenericViewSet):
     authentication_classes = (JWTAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = Version.objects.all()
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class DeviceConfig(AppConfig):
     name = 'apps.device'
+
+    def ready(self):
+        import apps.device.signals
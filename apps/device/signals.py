@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.core.utils.cache import bump_version_on_commit
+from apps.device.models import Device, OS, Platform, Version
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+@receiver(post_save, sender=Platform)
+@receiver(post_delete, sender=Platform)
+@receiver(post_save, sender=OS)
+@receiver(post_delete, sender=OS)
+@receiver(post_save, sender=Version)
+@receiver(post_delete, sender=Version)
+def invalidate_device_responses(sender, **kwargs):
+    bump_version_on_commit('devices')
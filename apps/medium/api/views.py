@@ -5,6 +5,7 @@ from rest_framework.response import Response
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.throttling import AnonRateThrottle
 
+from apps.core.utils.cache import cache_response
 from apps.medium.api.serializers import MediumSerializer, PublisherSerializer, CategorySerializer
 from apps.medium.models import Publisher, Category
 from ..consts import Medium
@@ -33,17 +34,24 @@ class PublisherViewSet(mixins.ListModelMixin,
     ordering_fields = ['name', 'extra_data__member_no', 'extra_data__view_efficiency', 'extra_data__tag']
 
     def get_queryset(self):
+        # subqueries rather than joins, a publisher with several cost models or categories is listed once
         queryset = super().get_queryset().filter(
-            cost_models__isnull=False,
+            id__in=Publisher.cost_models.through.objects.values('publisher_id'),
             medium=self.kwargs['medium']
         ).prefetch_related('categories')
 
         category = self.request.query_params.get('category', '')
         if category.isdigit():
-            queryset = queryset.filter(categories=category)
+            queryset = queryset.filter(
+                id__in=Publisher.categories.through.objects.filter(category_id=category).values('publisher_id')
+            )
 
         return queryset
 
+    @cache_response('medium', per_owner=False)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 class CategoryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     authentication_classes = (JWTAuthentication,)
@@ -60,6 +68,10 @@ class CategoryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
 
         return queryset
 
+    @cache_response('medium', per_owner=False)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 class UpdatePublisherViewSet(viewsets.ViewSet):
     throttle_classes = (AnonRateThrottle,)
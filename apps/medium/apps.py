@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MediumConfig(AppConfig):
     name = 'apps.medium'
+
+    def ready(self):
+        import apps.medium.signals
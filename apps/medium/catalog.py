@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.medium.models import CostModelPrice, Publisher
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogIndex(object):
+    """
+    Snapshot of the publisher catalog:
+        `category_publishers`: category id => publisher ids
+        `publisher_prices`: publisher id => ((cost model, publisher price, advertiser price), ...)
+        `medium_publishers`: medium => approved and enabled publisher ids
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.built_time = time.monotonic()
+
+        category_publishers = defaultdict(set)
+        for publisher_id, category_id in Publisher.categories.through.objects.values_list(
+                'publisher_id', 'category_id'
+        ).iterator():
+            category_publishers[category_id].add(publisher_id)
+        self.category_publishers = {key: frozenset(value) for key, value in category_publishers.items()}
+
+        prices = {
+            price[0]: price[1:]
+            for price in CostModelPrice.objects.values_list('id', 'cost_model', 'publisher_price', 'advertiser_price')
+        }
+        publisher_prices = defaultdict(list)
+        for publisher_id, price_id in Publisher.cost_models.through.objects.values_list(
+                'publisher_id', 'costmodelprice_id'
+        ).iterator():
+            publisher_prices[publisher_id].append(prices[price_id])
+        self.publisher_prices = {key: tuple(value) for key, value in publisher_prices.items()}
+
+        medium_publishers = defaultdict(set)
+        for publisher_id, medium in Publisher.approved_objects.values_list('id', 'medium').iterator():
+            medium_publishers[medium].add(publisher_id)
+        self.medium_publishers = {key: frozenset(value) for key, value in medium_publishers.items()}
+
+
+class PublisherCatalog(object):
+    """
+    Process-local publisher catalog index, rebuilt when the version shared through the django cache changes
+    or when it gets older than `PUBLISHER_CATALOG_TTL` seconds.
+    """
+    VERSION_KEY = 'medium:catalog:version'
+
+    def __init__(self):
+        self._index = None
+        self._lock = threading.Lock()
+
+    def version(self):
+        version = cache.get(self.VERSION_KEY)
+        if version is None:
+            cache.add(self.VERSION_KEY, uuid.uuid4().hex, None)
+            version = cache.get(self.VERSION_KEY)
+        return version
+
+    def index(self):
+        version = self.version()
+        index = self._index
+        if index is not None and index.version == version and \
+                time.monotonic() - index.built_time < settings.PUBLISHER_CATALOG_TTL:
+            return index
+
+        with self._lock:
+            index = self._index
+            if index is None or index.version != version or \
+                    time.monotonic() - index.built_time >= settings.PUBLISHER_CATALOG_TTL:
+                logger.debug(f'[building publisher catalog]-[version: {version}]')
+                index = self._index = CatalogIndex(version)
+            return index
+
+    def invalidate(self):
+        self._index = None
+        cache.set(self.VERSION_KEY, uuid.uuid4().hex, None)
+
+    def invalidate_on_commit(self):
+        # dropped right away for this process and again after commit, so other processes
+        # do not rebuild from data that is not committed yet
+        self.invalidate()
+        transaction.on_commit(self.invalidate)
+
+    def category_publisher_ids(self, categories):
+        index = self.index()
+        publisher_ids = set()
+        for category in categories:
+            publisher_ids |= index.category_publishers.get(getattr(category, 'pk', category), frozenset())
+        return publisher_ids
+
+    def publisher_ids(self, publishers_id, categories, cost_model=None):
+        """Ids of the selected publishers and publishers of the selected categories, `get_all_publishers`."""
+        publisher_ids = set(publishers_id) | self.category_publisher_ids(categories)
+        if cost_model:
+            prices = self.index().publisher_prices
+            publisher_ids = {
+                publisher_id for publisher_id in publisher_ids
+                if any(price[0] == cost_model for price in prices.get(publisher_id, ()))
+            }
+        return publisher_ids
+
+    def approved_publisher_ids(self, medium, category=None, priced=False):
+        index = self.index()
+        publisher_ids = index.medium_publishers.get(medium, frozenset())
+        if category is not None:
+            publisher_ids = publisher_ids & index.category_publishers.get(category, frozenset())
+        if priced:
+            publisher_ids = {publisher_id for publisher_id in publisher_ids if publisher_id in index.publisher_prices}
+        return publisher_ids
+
+    def publisher_prices(self, publisher_id, cost_model):
+        """`(publisher price, advertiser price)` pairs of the publisher for `cost_model`."""
+        return [
+            price[1:] for price in self.index().publisher_prices.get(publisher_id, ()) if price[0] == cost_model
+        ]
+
+    def price_bounds(self, publisher_ids):
+        """The same as `CostModelPrice.price_bounds` computed from the index."""
+        prices = self.index().publisher_prices
+        bounds = {}
+        for publisher_id in publisher_ids:
+            for cost_model, _, advertiser_price in prices.get(publisher_id, ()):
+                min_price, max_price = bounds.get(cost_model, (advertiser_price, advertiser_price))
+                bounds[cost_model] = (min(min_price, advertiser_price), max(max_price, advertiser_price))
+        return bounds
+
+
+catalog = PublisherCatalog()
@@ -62,6 +62,18 @@ class CostModelPrice(models.Model):
             min_price=Coalesce(Min('advertiser_price'), 0)
         )['min_price']
 
+    @staticmethod
+    def price_bounds(publishers):
+        """
+        Min and max advertiser price of `publishers` for every cost model, with one grouped query.
+        Returns `{cost_model: (min_price, max_price)}`, cost models without a price are left out.
+        """
+        prices = CostModelPrice.objects.filter(publisher__in=publishers).values('cost_model').annotate(
+            min_price=Min('advertiser_price'),
+            max_price=Max('advertiser_price'),
+        ).order_by()
+        return {price['cost_model']: (price['min_price'], price['max_price']) for price in prices}
+
 
 class ApprovedPublisherManager(models.Manager):
     def get_queryset(self):
@@ -107,4 +119,6 @@ class Publisher(models.Model):
 
     @staticmethod
     def get_by_categories(categories):
-        return Publisher.objects.filter(categories__in=categories).distinct()
+        return Publisher.objects.filter(
+            id__in=Publisher.categories.through.objects.filter(category__in=categories).values('publisher_id')
+        )
@@ -0,0 +1,62 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from apps.core.utils.cache import bump_version_on_commit
+from apps.medium.catalog import catalog
+from apps.medium.models import Publisher
+
+logger = logging.getLogger(__name__)
+
+
+class PublisherService(object):
+    SYNC_FIELDS = ('name', 'extra_data')
+
+    @staticmethod
+    def sync_publishers(medium, publishers, chunk_size=None):
+        """
+        Upserting `publishers`, a mapping of remote id to publisher fields, against the stored publishers
+        of `medium`. Existing rows are loaded with one query and only the changed ones are written back.
+        Returns the inserted, changed and unchanged counts.
+        """
+        chunk_size = chunk_size or settings.PUBLISHER_SYNC_CHUNK_SIZE
+        existing = {
+            (publisher.medium, publisher.ref_id): publisher
+            for publisher in Publisher.objects.filter(medium=medium).only(
+                'id', 'medium', 'ref_id', *PublisherService.SYNC_FIELDS
+            )
+        }
+
+        now = timezone.now()
+        created_publishers = []
+        changed_publishers = []
+        for ref_id, fields in publishers.items():
+            publisher = existing.get((medium, ref_id))
+            if publisher is None:
+                created_publishers.append(Publisher(medium=medium, ref_id=ref_id, **fields))
+                continue
+            if all(getattr(publisher, field) == value for field, value in fields.items()):
+                continue
+            for field, value in fields.items():
+                setattr(publisher, field, value)
+            # `auto_now` is not applied by bulk_update
+            publisher.updated_time = now
+            changed_publishers.append(publisher)
+
+        with transaction.atomic():
+            Publisher.objects.bulk_create(created_publishers, batch_size=chunk_size)
+            Publisher.objects.bulk_update(
+                changed_publishers, [*PublisherService.SYNC_FIELDS, 'updated_time'], batch_size=chunk_size
+            )
+            # bulk queries do not send model signals
+            if created_publishers or changed_publishers:
+                catalog.invalidate_on_commit()
+                bump_version_on_commit('medium')
+
+        return dict(
+            inserted=len(created_publishers),
+            changed=len(changed_publishers),
+            unchanged=len(publishers) - len(created_publishers) - len(changed_publishers),
+        )
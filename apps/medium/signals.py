@@ -0,0 +1,20 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from apps.core.utils.cache import bump_version_on_commit
+from apps.medium.catalog import catalog
+from apps.medium.models import Category, CostModelPrice, Publisher
+
+
+@receiver(post_save, sender=Publisher)
+@receiver(post_delete, sender=Publisher)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=CostModelPrice)
+@receiver(post_delete, sender=CostModelPrice)
+@receiver(m2m_changed, sender=Publisher.categories.through)
+@receiver(m2m_changed, sender=Publisher.cost_models.through)
+def invalidate_publisher_catalog(sender, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        catalog.invalidate_on_commit()
+        bump_version_on_commit('medium')
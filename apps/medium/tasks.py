@@ -1,3 +1,5 @@
+import logging
+
 from django.conf import settings
 
 from celery.task import periodic_task
@@ -5,25 +7,33 @@ from celery.schedules import crontab
 
 from apps.campaign.services import InstagramCampaignServices, TelegramCampaignServices
 from apps.medium.consts import Medium
-from apps.medium.models import Publisher
+from apps.medium.services import PublisherService
+from services.utils import distributed_lock
+
+logger = logging.getLogger(__name__)
 
 
 @periodic_task(run_every=crontab(**settings.UPDATE_TELEGRAM_PUBLISHERS_TASK_CRONTAB))
+@distributed_lock()
 def update_telegram_publishers_task():
     channels = TelegramCampaignServices().get_publishers()
-    for channel in channels:
-        Publisher.objects.update_or_create(
-            ref_id=channel['id'],
-            medium=Medium.TELEGRAM,
-            defaults={
-                'name': channel['title'],
-                'extra_data': {
-                    'member_no': channel['member_no'],
-                    'view_efficiency': channel['view_efficiency'],
-                    'tag': channel['tag']
-                }
+    publishers = {
+        channel['id']: {
+            'name': channel['title'],
+            'extra_data': {
+                'member_no': channel['member_no'],
+                'view_efficiency': channel['view_efficiency'],
+                'tag': channel['tag']
             }
-        )
+        }
+        for channel in channels
+    }
+    counts = PublisherService.sync_publishers(Medium.TELEGRAM, publishers)
+    logger.info(
+        f"[telegram publishers synced]-[inserted: {counts['inserted']}]-[changed: {counts['changed']}]"
+        f"-[unchanged: {counts['unchanged']}]"
+    )
+    return counts
 
 
 # TODO Instagram disable for now
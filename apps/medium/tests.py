@@ -1,3 +1,121 @@
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from apps.accounts.models import User
+from apps.core.consts import CostModel
+from apps.medium.catalog import catalog
+from apps.medium.consts import Medium
+from apps.medium.models import Category, CostModelPrice, Publisher
+from apps.medium.services import PublisherService
+
+
+class PublisherSyncTest(TestCase):
+    def test_sync_publishers(self):
+        publishers = {
+            ref_id: {'name': f'channel {ref_id}', 'extra_data': {'member_no': ref_id, 'tag': 'news'}}
+            for ref_id in range(1, 6)
+        }
+        counts = PublisherService.sync_publishers(Medium.TELEGRAM, publishers, chunk_size=2)
+        self.assertEqual(counts, dict(inserted=5, changed=0, unchanged=0))
+
+        updated_time = Publisher.objects.get(ref_id=2).updated_time
+        publishers[1]['name'] = 'renamed'
+        publishers[6] = {'name': 'channel 6', 'extra_data': {}}
+        with self.assertNumQueries(5):
+            # select, insert and update, plus the savepoint of the atomic block inside the test transaction
+            counts = PublisherService.sync_publishers(Medium.TELEGRAM, publishers)
+        self.assertEqual(counts, dict(inserted=1, changed=1, unchanged=4))
+
+        self.assertEqual(Publisher.objects.get(ref_id=1).name, 'renamed')
+        self.assertEqual(Publisher.objects.get(ref_id=2).updated_time, updated_time)
+        self.assertEqual(Publisher.objects.filter(medium=Medium.TELEGRAM).count(), 6)
+
+
+class CostModelPriceTest(TestCase):
+    def test_price_bounds(self):
+        prices = [
+            CostModelPrice.objects.create(
+                medium=Medium.TELEGRAM, cost_model=cost_model, grade=f'{grade}',
+                publisher_price=grade * 100, advertiser_price=grade * 100 + 50,
+            )
+            for cost_model in (CostModel.CPV, CostModel.CPC) for grade in range(1, 4)
+        ]
+        for i, price_ids in enumerate(([0, 1, 3], [2, 4], [5])):
+            publisher = Publisher.objects.create(medium=Medium.TELEGRAM, name=f'channel {i}', ref_id=i)
+            publisher.cost_models.set([prices[index] for index in price_ids])
+        publishers = Publisher.objects.filter(ref_id__in=[0, 1]).distinct()
+
+        with self.assertNumQueries(1):
+            bounds = CostModelPrice.price_bounds(publishers)
+
+        self.assertEqual(bounds, {
+            cost_model: (CostModelPrice.min_price(publishers, cost_model), CostModelPrice.max_price(publishers, cost_model))
+            for cost_model in (CostModel.CPV, CostModel.CPC)
+        })
+        self.assertNotIn(CostModel.CPI, bounds)
+
+
+class PublisherCatalogTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(medium=Medium.TELEGRAM, title='news', display_text='news')
+        self.price = CostModelPrice.objects.create(
+            medium=Medium.TELEGRAM, cost_model=CostModel.CPV, grade='A', publisher_price=100, advertiser_price=150,
+        )
+        self.publishers = [
+            Publisher.objects.create(
+                medium=Medium.TELEGRAM, name=f'channel {i}', ref_id=i, status=Publisher.STATUS_APPROVED, is_enable=True
+            )
+            for i in range(3)
+        ]
+        self.publishers[0].categories.add(self.category)
+        self.publishers[1].categories.add(self.category)
+        self.publishers[1].cost_models.add(self.price)
+
+    def test_catalog(self):
+        catalog.index()
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog.category_publisher_ids([self.category]), {p.id for p in self.publishers[:2]})
+            self.assertEqual(
+                catalog.publisher_ids([self.publishers[2].id], [self.category.id], CostModel.CPV),
+                {self.publishers[1].id}
+            )
+            self.assertEqual(
+                catalog.approved_publisher_ids(Medium.TELEGRAM, priced=True), {self.publishers[1].id}
+            )
+            self.assertEqual(catalog.price_bounds([p.id for p in self.publishers]), {CostModel.CPV: (150, 150)})
+
+        # querysets resolve the categories in SQL and agree with the index
+        self.assertEqual(
+            set(Publisher.get_by_categories([self.category]).values_list('id', flat=True)),
+            catalog.category_publisher_ids([self.category])
+        )
+
+    def test_publisher_list(self):
+        cache.clear()
+        self.publishers[1].cost_models.add(CostModelPrice.objects.create(
+            medium=Medium.TELEGRAM, cost_model=CostModel.CPC, grade='A', publisher_price=100, advertiser_price=150,
+        ))
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='test_user', password='F3DkePaSs0d'))
+
+        response = client.get(
+            f'/api/v1/medium/publishers/{Medium.TELEGRAM}/', {'category': self.category.id, 'limit': 50}
+        )
+        # priced publishers of the category, listed once whatever their count of cost models
+        self.assertEqual([publisher['id'] for publisher in response.data['results']], [self.publishers[1].id])
+
+    def test_invalidation(self):
+        catalog.index()
+        self.publishers[2].cost_models.add(self.price)
+        self.assertEqual(
+            catalog.approved_publisher_ids(Medium.TELEGRAM, priced=True), {p.id for p in self.publishers[1:]}
+        )
+
+        self.price.advertiser_price = 200
+        self.price.save()
+        self.assertEqual(catalog.publisher_prices(self.publishers[2].id, CostModel.CPV), [(100, 200)])
+
+        self.publishers[1].is_enable = False
+        self.publishers[1].save()
+        self.assertEqual(catalog.approved_publisher_ids(Medium.TELEGRAM, priced=True), {self.publishers[2].id})
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PaymentConfig(AppConfig):
     name = 'apps.payments'
+
+    def ready(self):
+        import apps.payments.signals
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from apps.payments.models import Transaction, WalletBalance
+
+
+class Command(BaseCommand):
+    help = 'Check the wallet balance snapshots against the transaction ledger.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='recompute the mismatched snapshots from the ledger')
+
+    def handle(self, *args, **options):
+        ledger = dict(Transaction.objects.values('user').annotate(value=Sum('value')).values_list('user', 'value'))
+        snapshots = dict(WalletBalance.objects.filter(value__isnull=False).values_list('user_id', 'value'))
+
+        mismatched = [
+            user_id for user_id, value in snapshots.items() if ledger.get(user_id, 0) != value
+        ]
+        for user_id in mismatched:
+            self.stdout.write(
+                f'user: {user_id} - snapshot: {snapshots[user_id]} - ledger: {ledger.get(user_id, 0)}'
+            )
+            if options['fix']:
+                with transaction.atomic():
+                    WalletBalance.objects.filter(user_id=user_id).update(value=None, last_transaction_id=None)
+                    WalletBalance.objects.lock(user_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(snapshots)} snapshots checked, {len(mismatched)} mismatched'
+            f'{", fixed" if options["fix"] and mismatched else ""}.'
+        ))
@@ -1,9 +1,10 @@
 import uuid
+from collections import defaultdict
 
 from django.contrib.auth import get_user_model
 from django.utils.translation import ugettext_lazy as _
-from django.db import models
-from django.db.models import Sum
+from django.db import models, transaction
+from django.db.models import Max, Sum
 from django.db.models.functions import Coalesce
 
 from khayyam import JalaliDatetime
@@ -36,6 +37,25 @@ from apps.core.consts import Bank
 #     ip = models.IPAddressField()
 #     created_time = models.DateTimeField(auto_now_add=True)
 
+class TransactionQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            # snapshots are locked in user order so concurrent bulk inserts do not deadlock
+            snapshots = {
+                user_id: WalletBalance.objects.lock(user_id)
+                for user_id in sorted({obj.user_id for obj in objs})
+            }
+            objs = super().bulk_create(objs, *args, **kwargs)
+
+            values = defaultdict(int)
+            for obj in objs:
+                values[obj.user_id] += obj.value
+            for user_id, snapshot in snapshots.items():
+                snapshot.apply(values[user_id], max(obj.pk or 0 for obj in objs if obj.user_id == user_id))
+        return objs
+
+
 class Transaction(models.Model):
     TYPE_DEPOSIT = 'DEPOSIT'
     TYPE_WITHDRAW = 'WITHDRAW'
@@ -60,8 +80,39 @@ class Transaction(models.Model):
     campaign = models.ForeignKey(Campaign, blank=True, null=True, on_delete=models.PROTECT)
     created_time = models.DateTimeField(auto_now_add=True)
 
+    objects = TransactionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-id'], name='transaction_user_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            # the saved user and value of an edited transaction, it may be moved to another user
+            previous = None
+            if self.pk is not None:
+                previous = Transaction.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'user_id', 'value'
+                ).first()
+            user_ids = {self.user_id} | ({previous[0]} if previous else set())
+            # snapshots are locked in user order so concurrent writes do not deadlock
+            snapshots = {user_id: WalletBalance.objects.lock(user_id) for user_id in sorted(user_ids)}
+            super().save(*args, **kwargs)
+            if previous:
+                snapshots[previous[0]].apply(-previous[1])
+            snapshots[self.user_id].apply(self.value, self.pk)
+
     @classmethod
     def balance(cls, user):
+        """Balance of the user without locking, read from the ledger until a write computes the snapshot."""
+        value = WalletBalance.objects.filter(user=user, value__isnull=False).values_list('value', flat=True).first()
+        if value is None:
+            value = cls.ledger_balance(user)
+        return value
+
+    @classmethod
+    def ledger_balance(cls, user):
         return Transaction.objects.filter(user=user).aggregate(balance=Coalesce(Sum('value'), 0))['balance']
 
     @property
@@ -69,6 +120,40 @@ class Transaction(models.Model):
         return JalaliDatetime(self.created_time).strftime('%C')
 
 
+class WalletBalanceManager(models.Manager):
+    def lock(self, user_id):
+        """
+        Locked balance snapshot of the user, computed from the ledger when it is missing.
+        Must be called inside a transaction, every write to the ledger of the user waits on this lock.
+        """
+        self.get_or_create(user_id=user_id)
+        snapshot = self.select_for_update().get(user_id=user_id)
+        if snapshot.value is None:
+            ledger = Transaction.objects.filter(user_id=user_id).aggregate(
+                value=Coalesce(Sum('value'), 0), last_transaction_id=Max('id')
+            )
+            snapshot.value = ledger['value']
+            snapshot.last_transaction_id = ledger['last_transaction_id']
+            snapshot.save(update_fields=['value', 'last_transaction_id', 'updated_time'])
+        return snapshot
+
+
+class WalletBalance(models.Model):
+    """Running total of the user transactions up to `last_transaction_id`, `value` is null until computed."""
+    updated_time = models.DateTimeField(_("updated time"), auto_now=True)
+    user = models.OneToOneField(get_user_model(), on_delete=models.CASCADE, related_name='wallet_balance')
+    value = models.BigIntegerField(_('value'), null=True)
+    last_transaction_id = models.PositiveIntegerField(_('last transaction id'), null=True)
+
+    objects = WalletBalanceManager()
+
+    def apply(self, value, transaction_id=None):
+        self.value += value
+        if transaction_id is not None:
+            self.last_transaction_id = max(self.last_transaction_id or 0, transaction_id)
+        self.save(update_fields=['value', 'last_transaction_id', 'updated_time'])
+
+
 class Deposit(models.Model):
     created_time = models.DateTimeField(_("created time"), auto_now_add=True)
     updated_time = models.DateTimeField(_("updated time"), auto_now=True)
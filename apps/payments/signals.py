@@ -0,0 +1,13 @@
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from apps.payments.models import Transaction, WalletBalance
+
+
+@receiver(post_delete, sender=Transaction)
+def update_wallet_balance(sender, instance, **kwargs):
+    # only computed snapshots are updated, the snapshot of a user being deleted must not be created again
+    WalletBalance.objects.filter(user_id=instance.user_id, value__isnull=False).update(
+        value=F('value') - instance.value
+    )
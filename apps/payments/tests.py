@@ -1,3 +1,89 @@
+from io import StringIO
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
 
-# Create your tests here.
+from apps.accounts.models import User
+from apps.payments.models import Transaction, WalletBalance
+
+
+class WalletBalanceTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test_user', password='F3DkePaSs0d')
+
+    def test_balance(self):
+        # a ledger written before the snapshot existed
+        Transaction.objects.bulk_create(
+            [Transaction(user=self.user, value=value, transaction_type=Transaction.TYPE_DEPOSIT) for value in (10, 20)]
+        )
+        WalletBalance.objects.all().delete()
+        self.assertEqual(Transaction.balance(self.user), 30)
+
+        Transaction.objects.create(user=self.user, value=1000, transaction_type=Transaction.TYPE_DEPOSIT)
+        deduct = Transaction.objects.create(user=self.user, value=-300, transaction_type=Transaction.TYPE_DEDUCT)
+        Transaction.objects.bulk_create(
+            [Transaction(user=self.user, value=-5, transaction_type=Transaction.TYPE_PENALTY) for _ in range(3)]
+        )
+        deduct.delete()
+
+        with self.assertNumQueries(1):
+            balance = Transaction.balance(self.user)
+        self.assertEqual(balance, Transaction.ledger_balance(self.user))
+        self.assertEqual(balance, 1015)
+        self.assertEqual(
+            WalletBalance.objects.get(user=self.user).last_transaction_id, Transaction.objects.latest('id').id
+        )
+
+    def test_move_transaction(self):
+        other = User.objects.create_user(username='other_user', password='F3DkePaSs0d')
+        Transaction.objects.create(user=other, value=50, transaction_type=Transaction.TYPE_DEPOSIT)
+        deposit = Transaction.objects.create(user=self.user, value=1000, transaction_type=Transaction.TYPE_DEPOSIT)
+
+        deposit.user = other
+        deposit.value = 800
+        deposit.save()
+
+        self.assertEqual(Transaction.balance(self.user), 0)
+        self.assertEqual(Transaction.balance(other), 850)
+        for user in (self.user, other):
+            self.assertEqual(Transaction.balance(user), Transaction.ledger_balance(user))
+
+    def test_balance_read_does_not_write(self):
+        Transaction.objects.bulk_create([Transaction(user=self.user, value=10, transaction_type=Transaction.TYPE_GIFT)])
+        WalletBalance.objects.all().delete()
+
+        self.assertEqual(Transaction.balance(self.user), 10)
+        self.assertFalse(WalletBalance.objects.exists())
+
+    def test_reconcile_wallet_balances(self):
+        Transaction.objects.create(user=self.user, value=1000, transaction_type=Transaction.TYPE_DEPOSIT)
+        WalletBalance.objects.filter(user=self.user).update(value=1)
+
+        out = StringIO()
+        call_command('reconcile_wallet_balances', stdout=out)
+        self.assertIn('1 mismatched', out.getvalue())
+        self.assertEqual(Transaction.balance(self.user), 1)
+
+        call_command('reconcile_wallet_balances', '--fix', stdout=StringIO())
+        self.assertEqual(Transaction.balance(self.user), 1000)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'query plans are checked on postgres')
+class TransactionQueryPlanTest(TestCase):
+    def test_user_transactions(self):
+        user = User.objects.create_user(username='test_user', password='F3DkePaSs0d')
+        Transaction.objects.bulk_create(
+            [Transaction(user=user, value=i, transaction_type=Transaction.TYPE_DEPOSIT) for i in range(50)]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('ANALYZE')
+
+        plan = Transaction.objects.filter(user=user).order_by('-id')[:20].explain()
+        self.assertNotIn('Seq Scan on payments_transaction', plan)
+        if 'Bitmap Heap Scan on payments_transaction' in plan:
+            self.assertIn('Bitmap Index Scan on transaction_user_idx', plan)
+        else:
+            self.assertIn('using transaction_user_idx on payments_transaction', plan)
@@ -0,0 +1,117 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class AdBotStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    CAMPAIGN_RE = re.compile(r'^/api/v1/campaigns/(?P<id>\d+)/(?P<action>report/|test/)?$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            return self.rfile.read(length)
+        return b''
+
+    def _send(self, status, data=None):
+        body = json.dumps(data).encode() if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        body = self._read_body()
+        self.server.record(method, self.path, len(body))
+        time.sleep(self.server.latency)
+
+        path = self.path.split('?')[0]
+        if method == 'POST' and path == '/api/v1/campaigns/':
+            return self._send(201, {'id': self.server.next_id()})
+        if method == 'POST' and path == '/api/v1/contents/':
+            return self._send(201, {'id': self.server.next_id()})
+        if method == 'POST' and path == '/api/v1/files/':
+            return self._send(201, {'id': self.server.next_id()})
+        if method == 'POST' and path in ('/api/v1/contents/bulk/', '/api/v1/files/bulk/') and self.server.support_bulk:
+            return self._send(201, [{'id': self.server.next_id()} for _ in json.loads(body)])
+        if method == 'GET' and path == '/api/v1/channels/':
+            return self._send(200, self.server.channels)
+
+        match = self.CAMPAIGN_RE.match(path)
+        if match:
+            campaign_id = int(match.group('id'))
+            if method == 'PATCH':
+                return self._send(200, {'id': campaign_id, 'is_enable': True})
+            if method == 'GET' and match.group('action') == 'report/':
+                return self._send(200, self.server.reports.get(campaign_id, []))
+            if method == 'GET' and match.group('action') == 'test/':
+                return self._send(200, {'detail': 'ok'})
+            if method == 'GET':
+                return self._send(200, self.server.campaigns.get(campaign_id, {'id': campaign_id, 'contents': []}))
+        return self._send(404, {'detail': 'Not found.'})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+
+class AdBotStubServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the AdBot API answering the endpoints used by `TelegramCampaignServices`,
+    used by tests and benchmarks. `latency` seconds are added to every response, the bulk endpoints
+    answer 404 unless `support_bulk` is set.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0, support_bulk=False, address=('127.0.0.1', 0)):
+        super().__init__(address, AdBotStubHandler)
+        self.latency = latency
+        self.support_bulk = support_bulk
+        self.channels = []
+        self.campaigns = {}
+        self.reports = {}
+        self.requests = []
+        self._id = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def next_id(self):
+        with self._lock:
+            self._id += 1
+            return self._id
+
+    def record(self, method, path, size):
+        with self._lock:
+            self.requests.append((method, path, size))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
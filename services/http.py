@@ -0,0 +1,170 @@
+import logging
+import mimetypes
+import os
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset(['HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'])
+RETRY_STATUS_CODES = (502, 503, 504)
+
+
+class HttpClient(object):
+    """
+    Shared HTTP client keeping one keep-alive session with its own connection pool per host.
+    Idempotent requests are retried with backoff on connection errors and gateway failures.
+    """
+
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None, max_retries=None,
+                 backoff_factor=None):
+        self.pool_size = pool_size or getattr(settings, 'HTTP_POOL_SIZE', 10)
+        self.connect_timeout = connect_timeout or getattr(settings, 'HTTP_CONNECT_TIMEOUT', 5)
+        self.read_timeout = read_timeout or getattr(settings, 'HTTP_READ_TIMEOUT', 30)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, 'HTTP_MAX_RETRIES', 3)
+        self.backoff_factor = backoff_factor if backoff_factor is not None else getattr(
+            settings, 'HTTP_RETRY_BACKOFF_FACTOR', 0.3
+        )
+
+        self._sessions = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _retry(self):
+        kwargs = dict(
+            total=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            raise_on_status=False,
+        )
+        try:
+            return Retry(allowed_methods=IDEMPOTENT_METHODS, **kwargs)
+        except TypeError:
+            # urllib3 < 1.26
+            return Retry(method_whitelist=IDEMPOTENT_METHODS, **kwargs)
+
+    def get_session(self, host):
+        session = self._sessions.get(host)
+        if session is not None:
+            return session
+
+        with self._lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.pool_size,
+                    max_retries=self._retry(),
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+            return self._sessions[host]
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (self.connect_timeout, self.read_timeout))
+        host = urlsplit(url).netloc
+
+        start = time.monotonic()
+        failed = True
+        try:
+            response = self.get_session(host).request(method, url, **kwargs)
+            # server errors are still failures once the retries are exhausted
+            failed = response.status_code >= 500
+            return response
+        finally:
+            self._record(host, time.monotonic() - start, failed)
+
+    def _record(self, host, elapsed, failed):
+        with self._lock:
+            stats = self._host_stats(host)
+            stats['requests'] += 1
+            stats['errors'] += int(failed)
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+        logger.debug(f'[request finished]-[host: {host}]-[elapsed: {elapsed:.3f}]-[failed: {failed}]')
+
+    def _host_stats(self, host):
+        return self._stats.setdefault(
+            host, dict(requests=0, errors=0, total_time=0.0, max_time=0.0, bytes_uploaded=0, bytes_skipped=0)
+        )
+
+    def record_upload(self, url, uploaded=0, skipped=0):
+        """Counting file bytes sent to `url`, and bytes not sent because the remote already had them."""
+        with self._lock:
+            stats = self._host_stats(urlsplit(url).netloc)
+            stats['bytes_uploaded'] += uploaded
+            stats['bytes_skipped'] += skipped
+
+    def stats(self):
+        """
+        Request count, error count and latency of the requests sent to each host by this process,
+        requests failing to connect or answered with a 5xx status are counted as errors.
+        """
+        with self._lock:
+            return {
+                host: dict(stats, avg_time=stats['total_time'] / stats['requests'] if stats['requests'] else 0)
+                for host, stats in self._stats.items()
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+class MultipartFileBody(object):
+    """
+    A `multipart/form-data` request body sending `fields` and one file, read from storage in chunks while
+    the request is sent. The length is known up front so the request keeps a `Content-Length` header.
+    """
+
+    def __init__(self, fields, name, file, chunk_size=64 * 1024):
+        self.boundary = uuid.uuid4().hex
+        self.file = file
+        self.chunk_size = chunk_size
+
+        filename = os.path.basename(file.name)
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        head = []
+        for key, value in fields.items():
+            if value is None:
+                continue
+            head.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'
+            )
+        head.append(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        )
+        self.head = ''.join(head).encode()
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode()
+        self.file_size = file.size
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return len(self.head) + self.file_size + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        for chunk in self.file.chunks(self.chunk_size):
+            yield chunk
+        yield self.tail
+
+
+http_client = HttpClient()
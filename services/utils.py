@@ -1,10 +1,21 @@
+import functools
+import hashlib
 import os
 import logging
 import string
 import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import requests
-from pid import PidFile
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .http import http_client
 
 
 logger = logging.getLogger(__name__)
@@ -30,17 +41,33 @@ def file_type(name):
     return document
 
 
+def file_size(file):
+    """Size of a django file in bytes, 0 when it is missing from the storage."""
+    try:
+        return file.size
+    except (OSError, ValueError):
+        return 0
+
+
+class RequestError(Exception):
+    """Raised by `custom_request` for error responses, keeping the response status code."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
 def custom_request(url, method='post', **kwargs):
     try:
         logger.debug(f"[making request]-[method: {method}]-[URL: {url}]-[kwargs: {kwargs}]")
-        req = requests.request(method, url, **kwargs)
+        req = http_client.request(method, url, **kwargs)
         req.raise_for_status()
     except requests.exceptions.HTTPError as e:
         logger.warning(
             f'[making request failed]-[response err: {e.response.text}]-[status code: {e.response.status_code}]'
             f'-[URL: {url}]-[exc: {e}]'
         )
-        raise Exception(e.response.text)
+        raise RequestError(e.response.text, status_code=e.response.status_code)
     except requests.exceptions.ConnectTimeout as e:
         logger.critical(f'[request failed]-[URL: {url}]-[exc: {e}]')
         raise
@@ -50,6 +77,32 @@ def custom_request(url, method='post', **kwargs):
     return req
 
 
+def run_concurrently(func, items, max_workers):
+    """
+    Calling `func(*item)` for each item of `items` on at most `max_workers` threads and returning
+    a `(result, exception)` pair for each item, in the order of `items`.
+    """
+    def call(item):
+        try:
+            return func(*item), None
+        except Exception as e:
+            return None, e
+
+    def call_in_thread(item):
+        try:
+            return call(item)
+        finally:
+            # database connections are per thread, do not leave them open in pool threads
+            connections.close_all()
+
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [call(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(call_in_thread, items))
+
+
 class AutoFilter:
     """
     `admin.ModelAdmin` classes that has a filter field by `admin_auto_filters.filters.AutocompleteFilter`
@@ -63,25 +116,158 @@ def random_string(length):
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
 
 
-def check_running(function_name):
-    if not os.path.exists('/tmp'):
-        os.mkdir('/tmp')
-    file_lock = PidFile(str(function_name), piddir='/tmp')
-    try:
-        file_lock.create()
-        return file_lock
-    except:
-        return None
+# cache backends keeping the values in the memory of each process, they can not exclude other processes
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_is_shared(alias='default'):
+    return settings.CACHES[alias]['BACKEND'] not in LOCAL_CACHE_BACKENDS
 
 
-def stop_duplicate_task(func):
-    def inner_function():
-        file_lock = check_running(func.__name__)
-        if not file_lock:
-            logger.error(f"[Another {func.__name__} is already running]")
+class CacheLease(object):
+    """
+    Lease on a key of the shared django cache, held until released or until `ttl` seconds pass without renewal.
+    """
+
+    def __init__(self, name, ttl):
+        self.key = f'lock:{name}'
+        self.ttl = ttl
+        self.token = uuid.uuid4().hex
+        self._valid_until = 0
+
+    def acquire(self):
+        start = time.monotonic()
+        acquired = cache.add(self.key, self.token, self.ttl)
+        if acquired:
+            self._valid_until = start + self.ttl
+        return acquired
+
+    def renew(self):
+        start = time.monotonic()
+        if start >= self._valid_until or cache.get(self.key) != self.token:
+            logger.error(f'[lease lost]-[key: {self.key}]')
             return False
-        func()
-        if file_lock:
-            file_lock.close()
-        return True
-    return inner_function
+        renewed = cache.touch(self.key, self.ttl)
+        if renewed:
+            self._valid_until = start + self.ttl
+        return renewed
+
+    def release(self):
+        # the cache can not compare and delete at once, so the key is deleted only while the lease is far enough
+        # from its expiry not to be taken by another worker in between, a lease close to it is left to expire
+        if time.monotonic() < self._valid_until - self.ttl / 3 and cache.get(self.key) == self.token:
+            cache.delete(self.key)
+        self._valid_until = 0
+
+    @contextmanager
+    def renewing(self):
+        """Renewing the lease in a background thread every third of its ttl while the block runs."""
+        with renew_leases([self]):
+            yield self
+
+
+class AdvisoryLock(object):
+    """
+    Session level postgres advisory lock on `name`, held by the database connection of the thread until
+    released or until the connection is closed.
+    """
+
+    def __init__(self, name, using=DEFAULT_DB_ALIAS):
+        self.name = name
+        # advisory lock keys are bigint
+        self.key = int.from_bytes(hashlib.blake2b(f'lock:{name}'.encode(), digest_size=8).digest(), 'big', signed=True)
+        self.using = using
+
+    def acquire(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [self.key])
+            return cursor.fetchone()[0]
+
+    def release(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [self.key])
+
+    @contextmanager
+    def renewing(self):
+        # held while the connection is open, there is nothing to renew
+        yield self
+
+
+@contextmanager
+def renew_leases(locks):
+    """Renewing the cache leases of `locks` in one background thread every third of their ttl while the block runs."""
+    leases = [lock for lock in locks if isinstance(lock, CacheLease)]
+    stopped = threading.Event()
+
+    def renew():
+        while not stopped.wait(min(lease.ttl for lease in leases) / 3):
+            for lease in leases:
+                lease.renew()
+
+    thread = threading.Thread(target=renew, daemon=True) if leases else None
+    if thread is not None:
+        thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        if thread is not None:
+            thread.join()
+
+
+def task_lock(name, ttl=None):
+    """
+    Lock of `name` shared by the workers, a lease in the shared cache or a postgres advisory lock when the cache
+    is local to each process.
+    """
+    if cache_is_shared():
+        return CacheLease(name, ttl or settings.TASK_LOCK_TTL)
+    return AdvisoryLock(name)
+
+
+@contextmanager
+def hold_locks(names, ttl=None):
+    """Acquiring the free task locks of `names` for the block and yielding the names acquired, in order."""
+    locks = [(name, task_lock(name, ttl)) for name in names]
+    acquired = [(name, lock) for name, lock in locks if lock.acquire()]
+    try:
+        with renew_leases([lock for _, lock in acquired]):
+            yield [name for name, _ in acquired]
+    finally:
+        for _, lock in acquired:
+            lock.release()
+
+
+def skipped_runs(name):
+    """Number of runs skipped because `name` was locked by another worker."""
+    return cache.get(f'lock:{name}:skipped', 0)
+
+
+def distributed_lock(name=None, ttl=None):
+    """
+    Running the decorated task in one worker at a time across hosts, runs started while the lock is held
+    are skipped and counted. The lock is a lease in the shared cache renewed while the task runs, or a postgres
+    advisory lock when the cache is local to each process.
+    """
+    def decorator(func):
+        lock_name = name or f'{func.__module__}.{func.__name__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            lock = task_lock(lock_name, ttl)
+            if not lock.acquire():
+                skipped_key = f'lock:{lock_name}:skipped'
+                cache.add(skipped_key, 0, None)
+                skipped = cache.incr(skipped_key)
+                logger.warning(f'[task skipped, lock is held]-[task: {lock_name}]-[skipped runs: {skipped}]')
+                return None
+            try:
+                with lock.renewing():
+                    return func(*args, **kwargs)
+            finally:
+                lock.release()
+        return wrapper
+    return decorator